@@ -0,0 +1,268 @@
+import math
+import random
+import time
+import card
+import engine
+
+class RandomPlayer:
+    """ A computer player that picks a uniformly random legal action """
+
+    def __init__(self, seed=None):
+        self.rng = random.Random(seed)
+
+
+    # Returns the action to take for the current player of 'game'
+    def chooseAction(self, game):
+        return self.rng.choice(game.legal_actions())
+
+
+
+class GreedyPlayer:
+    """ A computer player that plays a card whenever it can
+
+    Entangled cards are measured first, since they cost a turn anyway.
+    Otherwise it plays a random playable card and only draws from the
+    deck when nothing in its hand matches the played pile.
+    """
+
+    def __init__(self, seed=None):
+        self.rng = random.Random(seed)
+
+
+    # Returns the action to take for the current player of 'game'
+    def chooseAction(self, game):
+        cards = game.currentPlayer().cards
+        playable = [action for action in game.legal_actions() if action != engine.GameEngine.DRAW]
+        if len(playable) == 0:
+            return engine.GameEngine.DRAW
+
+        entangled = [action for action in playable if cards[action].isEntangled]
+        if len(entangled) > 0:
+            return entangled[0]
+        return self.rng.choice(playable)
+
+
+
+class ISMCTSNode:
+    """ A node of the information set search tree of ISMCTSPlayer
+
+    The moves of the searching player are keyed by GameEngine.actionKey().
+    The moves of the other players are keyed by what the searching player
+    sees of them, GameEngine.publicKey(): their hands are only sampled, so
+    "an opponent played a Red 3" names the same move in every
+    determinization and in the real game. Other chance events (draws and
+    the outcomes of the searching player's own cards) are not part of the
+    tree; every iteration samples them again in its own determinization.
+    """
+
+    def __init__(self, parent=None, playerIndex=None):
+        self.parent = parent
+        self.playerIndex = playerIndex # the player who made the move leading here
+        self.children = {}
+        self.visits = 0
+        self.availability = 0
+        self.reward = 0.0
+
+
+    # Upper confidence bound of the child, counting the iterations where its move was available
+    def score(self, explorationWeight):
+        return self.reward / self.visits + explorationWeight * math.sqrt(math.log(self.availability) / self.visits)
+
+
+
+class ISMCTSPlayer:
+    """ A computer player that searches with information set Monte Carlo Tree Search
+
+    Every iteration determinizes the game as seen by the current player
+    (see determinize()): the hidden hands of the other players, the colors
+    of their entangled cards and the hidden types of the top card of the
+    deck are sampled again, and so are the outcomes of every superposition
+    measurement and deck draw, since the determinized game runs on its
+    own seeded ANALYTIC session. The public state (the played pile, hand
+    sizes, the deck colors and its phase) is kept.
+
+    The tree is shared by all determinizations (single observer ISMCTS with
+    partially observable moves): at every node only the moves legal in the
+    current determinization compete, and each one is scored with UCB1 over
+    the iterations where it was available. Opponent moves that look the same
+    to the searching player share a node, see ISMCTSNode. Below the tree,
+    every player plays like a GreedyPlayer for at most maxRolloutTurns turns,
+    and a playout nobody won by then is scored by the hand sizes, see
+    rewards(). Random playouts draw far more often than real players do, so
+    they misjudge positions; short greedy playouts are both more accurate
+    and cheaper, leaving room for more iterations per decision.
+
+    chooseAction() runs up to 'playouts' iterations and stops early once
+    'timeBudget' seconds have passed, so a move never takes much longer than
+    the budget. The subtree of the moves played since the last decision is
+    kept as the new root, so earlier iterations are not thrown away.
+    """
+
+    def __init__(self, playouts=1000, timeBudget=1.0, seed=None, explorationWeight=0.7, maxRolloutTurns=10):
+        self.playouts = playouts
+        self.timeBudget = timeBudget
+        self.explorationWeight = explorationWeight
+        self.maxRolloutTurns = maxRolloutTurns
+        self.rng = random.Random(seed)
+        self.playoutPlayer = GreedyPlayer(self.rng.getrandbits(64))
+
+        self.root = None
+        self.rootGame = None
+        self.rootTurn = 0
+        self.observer = None # the player the tree was searched for
+        self.iterations = 0 # iterations run for the last decision
+
+
+    # Returns the action to take for the current player of 'game'
+    def chooseAction(self, game):
+        legal = game.legal_actions()
+        if len(legal) == 1:
+            return legal[0]
+
+        start = time.perf_counter()
+        root = self.reuseRoot(game)
+        self.iterations = 0
+        while self.iterations < self.playouts and time.perf_counter() - start < self.timeBudget:
+            self.iterate(root, self.determinize(game), game.playerIndex)
+            self.iterations += 1
+
+        self.root, self.rootGame, self.rootTurn, self.observer = root, game, game.turnCount, game.playerIndex
+
+        # play the most visited move that is legal in the real game
+        bestAction, bestVisits = engine.GameEngine.DRAW, -1
+        for action in legal:
+            child = root.children.get(game.actionKey(action))
+            if child is not None and child.visits > bestVisits:
+                bestAction, bestVisits = action, child.visits
+        return bestAction
+
+
+    # Follows the moves played since the last decision down the old tree, or starts a new tree
+    def reuseRoot(self, game):
+        if self.root is None or self.rootGame is not game or game.turnCount < self.rootTurn \
+                or game.playerIndex != self.observer:
+            return ISMCTSNode()
+
+        node = self.root
+        for turn in range(self.rootTurn, game.turnCount):
+            playerIndex, publicKey = game.publicHistory[turn]
+            node = node.children.get(game.history[turn] if playerIndex == self.observer else publicKey)
+            if node is None:
+                return ISMCTSNode()
+        node.parent = None
+        return node
+
+
+    def determinize(self, game):
+        """ Samples a game that is consistent with what the current player knows
+
+        Returns a fork of 'game' (see GameEngine.fork()) on the ANALYTIC backend.
+        """
+        observer = game.playerIndex
+        sample = game.fork(seed=self.rng.getrandbits(64), backend=card.Backend.ANALYTIC)
+
+        for i, samplePlayer in enumerate(sample.players):
+            # the observer only knows their own cards that are not entangled
+            if i == observer and not any(heldCard.isEntangled for heldCard in samplePlayer.cards):
+                continue
+            hiddenCards = []
+            for heldCard in samplePlayer.cards:
+                if heldCard.isEntangled:
+                    # an entangled card is a number card of an unknown color
+                    hiddenCards.append(card.Card.fromCodes([(self.rng.randrange(4) << 4) | self.rng.randrange(10)], True))
+                elif i == observer:
+                    hiddenCards.append(heldCard)
+                else:
+                    hiddenCards.append(card.Card.fromCodes(sample.deck.newCardCodes()))
+            samplePlayer.setHand(hiddenCards)
+
+        # only the colors and the phase of the top card of the deck are public
+        realDeck = game.deck
+        codes = sample.deck.newCardCodes()
+        while len(codes) != len(realDeck.deckColors):
+            codes = sample.deck.newCardCodes()
+        sample.deck.setTopCard(realDeck.deckColors, [card.Type(code & 0b1111) for code in codes])
+        sample.deck.ryGateCount = realDeck.ryGateCount
+        sample.deck.phase = realDeck.phase
+        sample.deck.topOfDeckColor = sample.deck.phaseColors(realDeck.phase)
+        return sample
+
+
+    # Returns the publicKey() of playing 'action' in 'sample', and the measured outcome it needs for step()
+    @classmethod
+    def publicMove(self, sample, action):
+        if action == engine.GameEngine.DRAW:
+            return ("draw",), None
+        heldCard = sample.currentPlayer().cards[action]
+        if heldCard.isEntangled:
+            return ("reveal",), None
+        # measure the card now, so the move can be told apart by its outcome before it is played
+        measuredColor, measuredType = heldCard.copy().measure(sample.session)
+        return ("play", (measuredColor.value << 4) | measuredType.value), (measuredColor, measuredType)
+
+
+    # Runs one search iteration for the player 'observer' on the determinized game 'sample'
+    def iterate(self, root, sample, observer):
+        node = root
+        path = [root]
+
+        # Selection and expansion
+        while not sample.isOver():
+            actions = {}
+            outcomes = {}
+            for action in sample.legal_actions():
+                if sample.playerIndex == observer:
+                    key, outcome = sample.actionKey(action), None
+                else:
+                    key, outcome = ISMCTSPlayer.publicMove(sample, action)
+                if key not in actions:
+                    actions[key] = action
+                    outcomes[key] = outcome
+
+            untried = [key for key in actions if key not in node.children]
+            for key in actions:
+                if key in node.children:
+                    node.children[key].availability += 1
+
+            if len(untried) > 0:
+                key = self.rng.choice(untried)
+                child = ISMCTSNode(node, sample.playerIndex)
+                child.availability = 1
+                node.children[key] = child
+            else:
+                key = max(actions, key=lambda k: node.children[k].score(self.explorationWeight))
+                child = node.children[key]
+
+            sample.step(actions[key], outcomes[key])
+            node = child
+            path.append(node)
+            if len(untried) > 0:
+                break
+
+        # Playout
+        for _ in range(self.maxRolloutTurns):
+            if sample.isOver():
+                break
+            sample.step(self.playoutPlayer.chooseAction(sample))
+
+        # Backpropagation
+        rewards = ISMCTSPlayer.rewards(sample)
+        for visited in path:
+            visited.visits += 1
+            if visited.playerIndex is not None:
+                visited.reward += rewards[visited.playerIndex]
+
+
+    @classmethod
+    def rewards(self, game):
+        """ The reward of every player at the end of a playout
+
+        The winner gets 1. If the playout stopped before anyone won,
+        players get up to 0.5 for having fewer cards than the others.
+        """
+        if game.isOver():
+            return [1.0 if i == game.winner else 0.0 for i in range(len(game.players))]
+
+        handSizes = [len(p.cards) for p in game.players]
+        others = len(handSizes) - 1
+        return [0.5 * sum(1 for other in handSizes if other > size) / others for size in handSizes]
@@ -0,0 +1,241 @@
+import numpy as np
+import card, deck
+
+class BatchGame:
+    """ Plays many games of QUNO at once on NumPy arrays
+
+    Every card state is its 6-bit code (color << 4 | type), see card.Color
+    and card.Type. The hands of all games are stored as count arrays:
+
+        singles[game, player, code]      single-state cards
+        pairs[game, player, pair]        superposition cards, one column per
+                                         unordered pair of codes (2016 pairs)
+        entangled[game, player, code]    unmeasured entangled cards
+
+    The played pile is an array of codes (-1 before the first card is played),
+    and the top of the deck is stored as its first/second colors and types
+    together with its RY phase counter.
+
+    step() advances every unfinished game by one turn, where the current
+    player picks uniformly among their legal actions (like ai.RandomPlayer).
+    The rules are the same as Card.isPlayable, Card.action, Deck.newCard and
+    Deck.addRYPhase. Measurements use the ANALYTIC backend's distributions:
+    the argmax of 1024 Grover shots is the marked state with overwhelming
+    probability, so a single card measures to its state and a superposition
+    card to either state with probability 1/2.
+
+    Attributes
+    ----------------
+    numGames : int
+        The number of games played in parallel.
+    numPlayers : int
+        The number of players in each game.
+    done : bool[numGames]
+        Whether each game is over.
+    winner : int[numGames]
+        The winning player of each game, or -1.
+    turns : int[numGames]
+        The number of turns each game took so far.
+    stats : dict
+        Per-game counters: cardsDrawn, superpositionsPlayed,
+        makeEntangledPlayed, addPhasesPlayed, entangledMeasured.
+    """
+
+    NUM_STATES = 64
+    STATE_COLOR = np.arange(NUM_STATES) >> 4
+    STATE_TYPE = np.arange(NUM_STATES) & 0b1111
+
+    # Every unordered pair of different codes, and the index of each pair
+    PAIR_FIRST, PAIR_SECOND = np.triu_indices(NUM_STATES, 1)
+    NUM_PAIRS = len(PAIR_FIRST)
+    PAIR_INDEX = np.full((NUM_STATES, NUM_STATES), -1)
+    PAIR_INDEX[PAIR_FIRST, PAIR_SECOND] = np.arange(NUM_PAIRS)
+    PAIR_INDEX[PAIR_SECOND, PAIR_FIRST] = np.arange(NUM_PAIRS)
+
+    # SINGLE_PLAYABLE[top, code] - whether a card can be played on top of the played pile.
+    # Row NUM_STATES stands for the empty pile, where every card can be played.
+    SINGLE_PLAYABLE = np.vstack([
+        (STATE_COLOR[:, None] == STATE_COLOR[None, :]) | (STATE_TYPE[:, None] == STATE_TYPE[None, :]),
+        np.ones((1, NUM_STATES), dtype=bool)])
+    PAIR_PLAYABLE = SINGLE_PLAYABLE[:, PAIR_FIRST] | SINGLE_PLAYABLE[:, PAIR_SECOND]
+
+    # The color pair of every Make Entangled type, indexed by type value
+    ENTANGLED_COLORS = np.full((16, 2), -1)
+    for entangledType, colors in [
+            (card.Type.MAKE_ENTANGLED_RED_BLUE,     (card.Color.RED,   card.Color.BLUE)),
+            (card.Type.MAKE_ENTANGLED_RED_GREEN,    (card.Color.RED,   card.Color.GREEN)),
+            (card.Type.MAKE_ENTANGLED_RED_YELLOW,   (card.Color.RED,   card.Color.YELLOW)),
+            (card.Type.MAKE_ENTANGLED_BLUE_GREEN,   (card.Color.BLUE,  card.Color.GREEN)),
+            (card.Type.MAKE_ENTANGLED_BLUE_YELLOW,  (card.Color.BLUE,  card.Color.YELLOW)),
+            (card.Type.MAKE_ENTANGLED_GREEN_YELLOW, (card.Color.GREEN, card.Color.YELLOW))]:
+        ENTANGLED_COLORS[entangledType.value] = [colors[0].value, colors[1].value]
+    del entangledType, colors
+
+
+    def __init__(self, numGames, numPlayers, seed=None, probOfMakeEntangled=None,
+                 probOfSuperposition=None, initialHandSize=5):
+        self.numGames = numGames
+        self.numPlayers = numPlayers
+        self.rng = np.random.default_rng(seed)
+        self.probOfMakeEntangled = probOfMakeEntangled if probOfMakeEntangled is not None \
+                                   else deck.Deck.probOfMakeEntangled
+        self.probOfSuperposition = probOfSuperposition if probOfSuperposition is not None \
+                                   else deck.Deck.probOfSuperposition
+
+        self.singles = np.zeros((numGames, numPlayers, BatchGame.NUM_STATES), dtype=np.int16)
+        self.pairs = np.zeros((numGames, numPlayers, BatchGame.NUM_PAIRS), dtype=np.int16)
+        self.entangled = np.zeros((numGames, numPlayers, BatchGame.NUM_STATES), dtype=np.int16)
+        self.handSize = np.zeros((numGames, numPlayers), dtype=np.int32)
+
+        self.playerIndex = np.zeros(numGames, dtype=np.int64)
+        self.topOfPlayedPile = np.full(numGames, -1)
+        self.done = np.zeros(numGames, dtype=bool)
+        self.winner = np.full(numGames, -1)
+        self.turns = np.zeros(numGames, dtype=np.int64)
+        self.stats = {name: np.zeros(numGames, dtype=np.int64) for name in
+                      ("cardsDrawn", "superpositionsPlayed", "makeEntangledPlayed",
+                       "addPhasesPlayed", "entangledMeasured")}
+
+        # The top card of every deck
+        self.deckFirst = np.zeros(numGames, dtype=np.int64)
+        self.deckSecond = np.zeros(numGames, dtype=np.int64)
+        self.ryGateCount = np.zeros(numGames, dtype=np.int64)
+        self.resetTopCards(np.arange(numGames))
+
+        # Deal the initial hands
+        games = np.repeat(np.arange(numGames), numPlayers * initialHandSize)
+        players = np.tile(np.repeat(np.arange(numPlayers), initialHandSize), numGames)
+        first, second = self.newCards(len(games))
+        self.addCards(games, players, first, second)
+
+
+    # Generates 'count' new cards, see Deck.generateCards()
+    def newCards(self, count):
+        return deck.Deck.generateCards(self.rng, count, self.probOfMakeEntangled, self.probOfSuperposition)
+
+
+    # Adds the cards (first, second) to the hands of the given games/players
+    def addCards(self, games, players, first, second):
+        isSingle = second < 0
+        np.add.at(self.singles, (games[isSingle], players[isSingle], first[isSingle]), 1)
+        pairs = BatchGame.PAIR_INDEX[first[~isSingle], second[~isSingle]]
+        np.add.at(self.pairs, (games[~isSingle], players[~isSingle], pairs), 1)
+        np.add.at(self.handSize, (games, players), 1)
+
+
+    # Replaces the top card of the decks of the given games
+    def resetTopCards(self, games):
+        first, second = self.newCards(len(games))
+        self.deckFirst[games] = first
+        self.deckSecond[games] = second
+        self.ryGateCount[games] = 0
+
+
+    def step(self):
+        """ Plays one turn in every unfinished game
+
+        Returns the number of games that were advanced.
+        """
+        games = np.nonzero(~self.done)[0]
+        if len(games) == 0:
+            return 0
+        rng = self.rng
+        players = self.playerIndex[games]
+        nextPlayers = (players + 1) % self.numPlayers
+        top = np.where(self.topOfPlayedPile[games] < 0, BatchGame.NUM_STATES, self.topOfPlayedPile[games])
+
+        # Every playable card (entangled cards always are) and drawing are equally likely
+        weights = np.concatenate([
+            self.singles[games, players] * BatchGame.SINGLE_PLAYABLE[top],
+            self.pairs[games, players] * BatchGame.PAIR_PLAYABLE[top],
+            self.entangled[games, players],
+            np.ones((len(games), 1), dtype=np.int16)], axis=1)
+        cumulative = np.cumsum(weights, axis=1)
+        target = rng.random(len(games)) * cumulative[:, -1]
+        choice = np.argmax(cumulative > target[:, None], axis=1)
+
+        pairStart = BatchGame.NUM_STATES
+        entangledStart = pairStart + BatchGame.NUM_PAIRS
+        drawChoice = entangledStart + BatchGame.NUM_STATES
+
+        # Single cards measure to their only state
+        isSingle = choice < pairStart
+        g, p, code = games[isSingle], players[isSingle], choice[isSingle]
+        self.singles[g, p, code] -= 1
+        playedGames = [g]
+        playedCodes = [code]
+        playedPlayers = [p]
+
+        # Superposition cards measure to either state
+        isPair = (choice >= pairStart) & (choice < entangledStart)
+        g, p, pair = games[isPair], players[isPair], choice[isPair] - pairStart
+        self.pairs[g, p, pair] -= 1
+        pickFirst = rng.random(len(pair)) < 0.5
+        playedGames.append(g)
+        playedCodes.append(np.where(pickFirst, BatchGame.PAIR_FIRST[pair], BatchGame.PAIR_SECOND[pair]))
+        playedPlayers.append(p)
+        self.stats["superpositionsPlayed"][g] += 1
+
+        # Measuring an entangled card wastes the turn
+        isEntangled = (choice >= entangledStart) & (choice < drawChoice)
+        g, p, code = games[isEntangled], players[isEntangled], choice[isEntangled] - entangledStart
+        self.entangled[g, p, code] -= 1
+        self.singles[g, p, code] += 1
+        self.stats["entangledMeasured"][g] += 1
+
+        # Drawing measures the top card of the deck, RY(k * pi/2) flips color[0] with probability sin^2(k * pi/4)
+        isDraw = choice == drawChoice
+        g, p = games[isDraw], players[isDraw]
+        flip = rng.random(len(g)) < deck.Deck.PHASE_FLIP_PROBABILITIES[self.ryGateCount[g] % 4]
+        first = self.deckFirst[g] ^ (flip.astype(np.int64) << 4)
+        second = self.deckSecond[g]
+        second = np.where(second < 0, second, second ^ (flip.astype(np.int64) << 4))
+        self.addCards(g, p, first, second)
+        self.resetTopCards(g)
+        self.stats["cardsDrawn"][g] += 1
+
+        # Played cards go on the pile and do their action
+        g = np.concatenate(playedGames)
+        code = np.concatenate(playedCodes)
+        p = np.concatenate(playedPlayers)
+        self.handSize[g, p] -= 1
+        self.topOfPlayedPile[g] = code
+        playedType = code & 0b1111
+
+        isAddPhase = playedType == card.Type.ADD_PHASE.value
+        self.ryGateCount[g[isAddPhase]] += 1
+        self.stats["addPhasesPlayed"][g[isAddPhase]] += 1
+
+        isMakeEntangled = playedType >= card.Type.MAKE_ENTANGLED_RED_BLUE.value
+        g, colors = g[isMakeEntangled], BatchGame.ENTANGLED_COLORS[playedType[isMakeEntangled]]
+        currIsFirst = rng.random(len(g)) < 0.5
+        currColor = np.where(currIsFirst, colors[:, 0], colors[:, 1])
+        nextColor = np.where(currIsFirst, colors[:, 1], colors[:, 0])
+        self.topOfPlayedPile[g] = (currColor << 4) | rng.integers(0, 10, len(g))
+        nextP = (self.playerIndex[g] + 1) % self.numPlayers
+        self.entangled[g, nextP, (nextColor << 4) | rng.integers(0, 10, len(g))] += 1
+        self.handSize[g, nextP] += 1
+        self.stats["makeEntangledPlayed"][g] += 1
+
+        # Check the win condition and pass the turn
+        self.turns[games] += 1
+        won = self.handSize[games, players] == 0
+        self.done[games[won]] = True
+        self.winner[games[won]] = players[won]
+        self.playerIndex[games[~won]] = nextPlayers[~won]
+
+        return len(games)
+
+
+    def run(self, maxTurns=10000):
+        """ Plays every game until it is won or 'maxTurns' turns were played
+
+        Returns the total number of turns played.
+        """
+        totalTurns = 0
+        for _ in range(maxTurns):
+            advanced = self.step()
+            if advanced == 0:
+                break
+            totalTurns += advanced
+        return totalTurns
@@ -0,0 +1,481 @@
+""" Performance benchmarks for QUNO
+
+Run from the repository root:
+    python benchmark.py                     runs every benchmark
+    python benchmark.py startup measure     runs only the given benchmark(s)
+    python benchmark.py --aer               also runs the Aer backend (slow)
+    python benchmark.py --save              stores the results under benchmark_results/<commit>.json
+    python benchmark.py --compare abc1234   prints the results next to those stored for commit abc1234
+
+Every benchmark returns a dictionary of measurement names to values
+(seconds unless the name says otherwise), which is printed as a table.
+Checks whose name ends in "(0/1)" must be 1; the "p-value" rows compare
+the outcome distribution of a fast measurement path with the circuit path,
+and are summed up by such a check. The exit status is 1 if any check failed.
+"""
+import argparse
+import gc
+import json
+import os
+import subprocess
+import sys
+import time
+import statistics
+import tracemalloc
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+RESULTS_DIR = os.path.join(REPO_DIR, "benchmark_results")
+
+# Below this p-value, two outcome distributions are reported as different
+SIGNIFICANCE = 0.001
+
+
+# Runs 'args' in a fresh Python process 'repeats' times, returns the median wall-clock seconds
+def timeProcess(args, repeats):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        subprocess.run([sys.executable] + args, cwd=REPO_DIR, stdin=subprocess.DEVNULL,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def benchStartup(repeats=5):
+    """ Cold-start latency of the game
+
+    'quno.py title screen' starts the game with no input available, so the
+    process exits right after the title screen asks for the number of players.
+    qiskit should not be imported until the first quantum measurement,
+    which the 'qiskit not imported' check makes sure of.
+    """
+    results = {}
+    results["python interpreter"] = timeProcess(["-c", "pass"], repeats)
+    results["import card"] = timeProcess(["-c", "import card"], repeats)
+    results["import deck"] = timeProcess(["-c", "import deck"], repeats)
+    results["quno.py title screen"] = timeProcess(["quno.py"], repeats)
+
+    check = subprocess.run([sys.executable, "-c", "import sys, quno; print(int('qiskit' in sys.modules))"],
+                           cwd=REPO_DIR, capture_output=True, text=True)
+    results["qiskit not imported at startup (0/1)"] = int(check.stdout.strip() == "0")
+    return results
+
+
+# Calls 'function' 'number' times per run, returns the median seconds per call over 'repeats' runs
+def timeCall(function, number=100, repeats=5):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        timings.append((time.perf_counter() - start) / number)
+    return statistics.median(timings)
+
+
+# Returns the bytes still allocated by the result of 'build', and the result
+def allocatedBy(build):
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build()
+    gc.collect()
+    allocated = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return allocated, result
+
+
+# The circuit backends to time: the statevector simulator, and Aer when asked for
+def circuitBackends(aer):
+    import card
+    return [card.Backend.STATEVECTOR] + ([card.Backend.AER] if aer else [])
+
+
+def benchCard(aer=False):
+    """ Creating cards and building their oracle circuits
+
+    'initialize_qc (new)' builds the oracle of a state set for the first
+    time, 'initialize_qc (cached)' gets it from the oracle cache.
+    """
+    import card
+    results = {}
+    colors, types = [card.Color.RED, card.Color.GREEN], [card.Type(2), card.Type(7)]
+    results["Card.__init__"] = timeCall(lambda: card.Card(colors, types), 10000)
+    results["Card.fromCodes"] = timeCall(lambda: card.Card.fromCodes([0x02, 0x37]), 10000)
+
+    testCard = card.Card(colors, types)
+    def buildNew():
+        card.Card.oracleCache.clear()
+        testCard.initialize_qc()
+    results["initialize_qc (new)"] = timeCall(buildNew, 20)
+    results["initialize_qc (cached)"] = timeCall(testCard.initialize_qc, 1000)
+    results["groverCircuit"] = timeCall(testCard.groverCircuit, 20)
+    return results
+
+
+# The original measurement circuit: Toffoli oracles, and a diffuser built from Card.recCZa()
+def toffoliGroverCircuit(stateCodes):
+    import numpy as np
+    import card
+    from qiskit import QuantumCircuit
+    W = QuantumCircuit(7)
+    W.h(W.qubits[1:7])
+    W.x(W.qubits[1:7])
+    card.Card.recCZa(W, 1, W.qubits[2:7], W.qubits[1])
+    W.x(W.qubits[1:7])
+    W.h(W.qubits[1:7])
+
+    oracle = card.Card.toffoliOracleCircuit(stateCodes)
+    measureQC = QuantumCircuit(7, 6)
+    measureQC.x(0)
+    measureQC.h(range(7))
+    for _ in range(int(np.floor(np.pi * (np.sqrt(2**6/len(stateCodes))) / 4))):
+        measureQC.compose(oracle, inplace=True)
+        measureQC.compose(W, inplace=True)
+    measureQC.h(0)
+    measureQC.x(0)
+    for i in range(6):
+        measureQC.measure(i+1, i)
+    return measureQC
+
+
+def benchOracle(aer=False):
+    """ Gate counts, depths and timings of the oracle against the original construction
+
+    The original oracle is a recursive 6-control Toffoli in an X gate
+    sandwich for every marked state (Card.toffoliOracleCircuit()), the
+    current one a diagonal phase oracle (Card.phaseOracle()). Both are
+    also compared after transpiling to the u/cx basis, and as part of
+    the whole measurement circuit. The "(0/1)" checks are the regression
+    checks: the current circuits must not be larger or deeper than the
+    original ones, and must give the same outcome distribution. The last
+    two checks compare the oracles of every single state and of a sample
+    of superposition state sets.
+    """
+    import numpy as np
+    import card, statevector
+    from qiskit import transpile
+    results = {}
+    simulator = statevector.StatevectorSimulator(1)
+    isSmaller = isSame = True
+    for codes, label in (([0x12], "single"), ([0x12, 0x35], "superposition")):
+        testCard = card.Card.fromCodes(codes)
+        for name, oracle, grover in (("toffoli", card.Card.toffoliOracleCircuit(codes), toffoliGroverCircuit(codes)),
+                                     ("phase", card.Card.oracleCircuit(codes), testCard.groverCircuit())):
+            for circuitName, qc in (("oracle", oracle), ("measure circuit", grover)):
+                basisQC = transpile(qc, basis_gates=["u", "cx"], optimization_level=0)
+                sizes = (qc.size(), qc.depth(), basisQC.size(), basisQC.depth())
+                results["{} {} {} gates".format(label, name, circuitName)] = sizes[0]
+                results["{} {} {} depth".format(label, name, circuitName)] = sizes[1]
+                results["{} {} {} u/cx gates".format(label, name, circuitName)] = sizes[2]
+                results["{} {} {} u/cx depth".format(label, name, circuitName)] = sizes[3]
+                if name == "toffoli":
+                    toffoliSizes = sizes
+                else:
+                    isSmaller = isSmaller and all(new <= old for new, old in zip(sizes, toffoliSizes))
+
+        results[label + " toffoli oracle build"] = timeCall(lambda: card.Card.toffoliOracleCircuit(codes), 5, 3)
+        def buildNew():
+            card.Card.oracleCache.clear()
+            card.Card.oracleCircuit(codes)
+        results[label + " phase oracle build"] = timeCall(buildNew, 20, 3)
+
+        toffoliGrover, phaseGrover = toffoliGroverCircuit(codes), testCard.groverCircuit()
+        results[label + " toffoli statevector run"] = timeCall(lambda: simulator.probabilities(toffoliGrover), 3, 3)
+        results[label + " phase statevector run"] = timeCall(lambda: simulator.probabilities(phaseGrover), 3, 3)
+        isSame = isSame and np.allclose(simulator.probabilities(toffoliGrover), simulator.probabilities(phaseGrover))
+
+    results["no larger or deeper than toffoli (0/1)"] = int(isSmaller)
+    results["same outcome distribution (0/1)"] = int(isSame)
+
+    # every single state, and a sample of the superposition state sets
+    import random
+    pairs = random.Random(1).sample([[a, b] for a in range(64) for b in range(a + 1, 64)], 32)
+    results["oracles checked"] = 64 + len(pairs)
+    isSmaller = isSame = True
+    for codes in [[code] for code in range(64)] + pairs:
+        toffoliOracle, phaseOracle = card.Card.toffoliOracleCircuit(codes), card.Card.oracleCircuit(codes)
+        isSmaller = isSmaller and phaseOracle.size() <= toffoliOracle.size() and phaseOracle.depth() <= toffoliOracle.depth()
+        isSame = isSame and sameOracleAction(simulator, toffoliOracle, phaseOracle)
+    results["every oracle no larger or deeper than toffoli (0/1)"] = int(isSmaller)
+    results["every oracle acts like toffoli (0/1)"] = int(isSame)
+    return results
+
+
+# Whether two oracles act the same on every color and type state, with the output qubit in the |-> state
+def sameOracleAction(simulator, firstOracle, secondOracle):
+    import numpy as np
+    from qiskit import QuantumCircuit
+    states = []
+    for oracle in (firstOracle, secondOracle):
+        qc = QuantumCircuit(7)
+        qc.x(0)
+        qc.h(range(7)) # the uniform superposition shows the phase of every state
+        qc.compose(oracle, inplace=True)
+        states.append(simulator.simulate(qc)[0])
+    # equal up to a global phase
+    return bool(np.isclose(abs(np.vdot(states[0], states[1])), 1))
+
+
+def benchMeasure(aer=False):
+    """ Card.measure on every backend, for single and superposition cards
+
+    The circuit backends are timed with and without the distribution cache
+    of the session: 'uncached' runs the circuit on every call.
+    """
+    import card, session
+    results = {}
+    for codes, label in (([0x12], "single"), ([0x12, 0x35], "superposition")):
+        measure = lambda s: card.Card.fromCodes(codes).measure(s)
+
+        analytic = session.QuantumSession(card.Backend.ANALYTIC, seed=1)
+        results["ANALYTIC " + label] = timeCall(lambda: measure(analytic), 1000)
+        for backend in circuitBackends(aer):
+            uncached = session.QuantumSession(backend, seed=1, cacheDistributions=False)
+            measure(uncached) # the first call transpiles
+            results[backend.name + " " + label + " uncached"] = timeCall(lambda: measure(uncached), 5, 3)
+            cached = session.QuantumSession(backend, seed=1)
+            measure(cached)
+            results[backend.name + " " + label] = timeCall(lambda: measure(cached), 1000)
+    return results
+
+
+def benchDeck(aer=False):
+    """ Deck.getTopCard at different phases, and Deck.newEntangled
+
+    Drawing should take about the same time whatever ryGateCount is.
+    """
+    import card, deck, session
+    results = {}
+    for backend in [card.Backend.ANALYTIC] + circuitBackends(aer):
+        quantumSession = session.QuantumSession(backend, seed=1, cacheDistributions=False)
+        testDeck = deck.Deck(quantumSession, seed=1)
+        testDeck.getTopCard()
+        number = 1000 if backend == card.Backend.ANALYTIC else 20
+
+        for ryGateCount in (0, 1, 2, 5, 50):
+            def draw():
+                for _ in range(ryGateCount):
+                    testDeck.addRYPhase()
+                testDeck.getTopCard()
+            results["{} getTopCard ryGateCount={}".format(backend.name, ryGateCount)] = timeCall(draw, number)
+
+        testDeck.newEntangled([card.Color.RED, card.Color.BLUE])
+        results[backend.name + " newEntangled"] = timeCall(
+            lambda: testDeck.newEntangled([card.Color.RED, card.Color.BLUE]), number)
+    return results
+
+
+def benchHands():
+    """ Dealing the initial hands of 2 to 8 players """
+    import card, deck, player, session
+    results = {}
+    quantumSession = session.QuantumSession(card.Backend.ANALYTIC, seed=1)
+    testDeck = deck.Deck(quantumSession, seed=1)
+    for numPlayers in range(2, 9):
+        results["initialize_hand x{} players".format(numPlayers)] = timeCall(
+            lambda: [player.Player(i + 1, testDeck) for i in range(numPlayers)], 1000)
+    return results
+
+
+# Plays one seeded game with random moves, returns the number of turns
+def playScriptedGame(backend, seed, numPlayers=4, maxTurns=2000):
+    import ai, engine
+    game = engine.GameEngine(numPlayers, backend, seed=seed)
+    bot = ai.RandomPlayer(seed)
+    while not game.isOver() and game.turnCount < maxTurns:
+        game.step(bot.chooseAction(game))
+    return game.turnCount
+
+
+def benchGames(aer=False):
+    """ Complete scripted games: seeded 4 player games between random players """
+    import card
+    results = {}
+    games = 20
+    start = time.perf_counter()
+    turns = sum(playScriptedGame(card.Backend.ANALYTIC, seed) for seed in range(games))
+    elapsed = time.perf_counter() - start
+    results["ANALYTIC per game"] = elapsed / games
+    results["ANALYTIC per turn"] = elapsed / turns
+
+    for backend in circuitBackends(aer):
+        start = time.perf_counter()
+        turns = playScriptedGame(backend, 0, maxTurns=200)
+        results[backend.name + " per turn (200 turns)"] = (time.perf_counter() - start) / turns
+    return results
+
+
+def benchMemory():
+    """ Memory used by cards and by games, in bytes """
+    import card, engine
+    results = {}
+    count = 10000
+    allocated, cards = allocatedBy(lambda: [card.Card.fromCodes([0x02, 0x37]) for _ in range(count)])
+    results["bytes per card"] = allocated // count
+
+    allocated, game = allocatedBy(lambda: engine.GameEngine(4, card.Backend.ANALYTIC, seed=1))
+    results["bytes per new 4 player game"] = allocated
+
+    def playedGame():
+        import ai
+        played = engine.GameEngine(4, card.Backend.ANALYTIC, seed=1)
+        bot = ai.RandomPlayer(1)
+        for _ in range(100):
+            if played.isOver():
+                break
+            played.step(bot.chooseAction(played))
+        return played
+    allocated, game = allocatedBy(playedGame)
+    results["bytes per 4 player game after 100 turns"] = allocated
+
+    allocated, forked = allocatedBy(game.fork)
+    results["bytes per fork"] = allocated
+    return results
+
+
+# Counts the measured outcomes of 'trials' measurements made by measureOnce(quantumSession)
+def outcomeCounts(measureOnce, quantumSession, trials):
+    counts = {}
+    for _ in range(trials):
+        outcome = measureOnce(quantumSession)
+        counts[outcome] = counts.get(outcome, 0) + 1
+    return counts
+
+
+# The p-value of a chi-square test that two outcome counts come from the same distribution
+def sameDistributionPValue(counts, referenceCounts):
+    from scipy.stats import chi2_contingency
+    outcomes = sorted(set(counts) | set(referenceCounts), key=str)
+    if len(outcomes) < 2:
+        return 1.0
+    table = [[counts.get(o, 0) for o in outcomes], [referenceCounts.get(o, 0) for o in outcomes]]
+    return float(chi2_contingency(table)[1])
+
+
+def benchDistributions(aer=False, trials=400):
+    """ Statistical checks that the fast measurement paths match the circuit path
+
+    The reference is the circuit path without any cache: Aer with --aer,
+    the statevector simulator otherwise. It is compared with the ANALYTIC
+    backend and with the cached distributions of a circuit session (see
+    QuantumSession.storeDistribution()), for a single card, a superposition
+    card, the deck at every phase and the entangled pair. Every comparison
+    reports the p-value of a chi-square test, and the final check is 1 if
+    none of them is below SIGNIFICANCE.
+    """
+    import card, deck, session
+    reference = card.Backend.AER if aer else card.Backend.STATEVECTOR
+
+    def measureCard(codes):
+        return lambda s: card.Card.fromCodes(codes).measure(s)
+
+    def drawAtPhase(phase):
+        def draw(s):
+            testDeck = deck.Deck(s)
+            testDeck.setTopCard([card.Color.GREEN], [card.Type(4)])
+            for _ in range(phase):
+                testDeck.addRYPhase()
+            return testDeck.getTopCard().knownColor[0]
+        return draw
+
+    def entangle(s):
+        return deck.Deck(s).newEntangled([card.Color.RED, card.Color.YELLOW])[0][0]
+
+    cases = [("single card", measureCard([0x12])), ("superposition card", measureCard([0x12, 0x35]))] \
+            + [("deck phase {}".format(phase), drawAtPhase(phase)) for phase in range(4)] \
+            + [("entangled pair", entangle)]
+
+    results = {}
+    allMatch = True
+    for name, measureOnce in cases:
+        referenceCounts = outcomeCounts(measureOnce, session.QuantumSession(reference, seed=1, cacheDistributions=False), trials)
+        for label, fastSession in (("ANALYTIC", session.QuantumSession(card.Backend.ANALYTIC, seed=2)),
+                                   ("cached " + reference.name, session.QuantumSession(reference, seed=3))):
+            pValue = sameDistributionPValue(outcomeCounts(measureOnce, fastSession, trials), referenceCounts)
+            results["{} vs {}: {} p-value".format(label, reference.name, name)] = pValue
+            allMatch = allMatch and pValue >= SIGNIFICANCE
+
+    results["all distributions match (0/1)"] = int(allMatch)
+    return results
+
+
+BENCHMARKS = {
+    "startup" : benchStartup,
+    "card" : benchCard,
+    "oracle" : benchOracle,
+    "measure" : benchMeasure,
+    "deck" : benchDeck,
+    "hands" : benchHands,
+    "games" : benchGames,
+    "memory" : benchMemory,
+    "distributions" : benchDistributions,
+}
+
+# The benchmarks that can also run on the Aer backend
+AER_BENCHMARKS = ("card", "measure", "deck", "games", "distributions")
+
+
+# The names of the checks in 'results' that failed
+def failedChecks(results):
+    return [measurement for measurement, value in results.items() if measurement.endswith("(0/1)") and value != 1]
+
+
+# The commit the results belong to, with "-dirty" if the tree has changes
+def currentCommit():
+    commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR,
+                            capture_output=True, text=True).stdout.strip() or "unknown"
+    dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=REPO_DIR,
+                           capture_output=True, text=True).stdout.strip()
+    return commit + ("-dirty" if dirty else "")
+
+
+def printResults(name, results, previous=None):
+    print(name)
+    for measurement, value in results.items():
+        if isinstance(value, float):
+            line = "    {:<55} {:>14.6g}".format(measurement, value)
+        else:
+            line = "    {:<55} {:>14}".format(measurement, value)
+        if previous is not None and isinstance(previous.get(measurement), (int, float)) and previous[measurement] != 0 \
+                and not measurement.endswith("p-value") and not measurement.endswith("(0/1)"):
+            line += "   {:>7.2f}x".format(value / previous[measurement])
+        if measurement in failedChecks(results):
+            line += "   FAILED"
+        print(line)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runs the QUNO benchmarks.")
+    parser.add_argument("benchmarks", nargs="*", default=[],
+                        help="any of " + ", ".join(BENCHMARKS) + "; defaults to every benchmark")
+    parser.add_argument("--aer", action="store_true", help="also run the Aer backend")
+    parser.add_argument("--save", action="store_true", help="store the results for the current commit")
+    parser.add_argument("--compare", metavar="COMMIT", help="show the ratio to the results stored for COMMIT")
+    args = parser.parse_args()
+    unknown = [name for name in args.benchmarks if name not in BENCHMARKS]
+    if len(unknown) > 0:
+        parser.error("unknown benchmark " + ", ".join(unknown) + " (choose from " + ", ".join(BENCHMARKS) + ")")
+
+    previous = {}
+    if args.compare is not None:
+        with open(os.path.join(RESULTS_DIR, args.compare + ".json")) as resultsFile:
+            previous = json.load(resultsFile)["results"]
+
+    allResults = {}
+    for name in args.benchmarks or list(BENCHMARKS):
+        results = BENCHMARKS[name](aer=args.aer) if name in AER_BENCHMARKS else BENCHMARKS[name]()
+        allResults[name] = results
+        printResults(name, results, previous.get(name) if args.compare is not None else None)
+
+    if args.save:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        commit = currentCommit()
+        with open(os.path.join(RESULTS_DIR, commit + ".json"), "w") as resultsFile:
+            json.dump({"commit": commit, "time": time.time(), "aer": args.aer, "results": allResults},
+                      resultsFile, indent=2)
+        print("Saved the results to " + os.path.join(RESULTS_DIR, commit + ".json"))
+
+    failed = [name + ": " + check for name, results in allResults.items() for check in failedChecks(results)]
+    if len(failed) > 0:
+        print("FAILED checks:\n    " + "\n    ".join(failed))
+        sys.exit(1)
@@ -1,10 +1,10 @@
-from qiskit import QuantumCircuit, QuantumRegister, ClassicalRegister, Aer, execute
-from qiskit.visualization import plot_histogram, plot_state_qsphere, plot_bloch_multivector, plot_bloch_vector
 from enum import Enum
 import heapq
 from operator import itemgetter
+from collections import OrderedDict
+import threading
 
-import player, quno
+import instrument, player, session
 import numpy as np
 
 
@@ -90,13 +90,34 @@ class Type(Enum):
             return "Make Entangled Green and Yellow Pair"
 
 
+class Backend(Enum):
+    """ Selects how the quantum measurements of a game are carried out
+
+    AER runs the full Grover circuit through Qiskit's Aer Simulator.
+    ANALYTIC skips circuit simulation (and qiskit) entirely and samples each
+    outcome from its closed-form distribution, e.g. that of Grover's algorithm.
+    STATEVECTOR runs the same circuits as AER, but on the built-in NumPy
+    simulator in statevector.py, so qiskit-aer is not needed.
+    """
+    AER         = 0
+    ANALYTIC    = 1
+    STATEVECTOR = 2
+
+
 class Card:
     """ Represents a card in the game
     Attributes
     ----------------
     qc : QuantumCircuit
         The 7-qubit circuit that represents the underlying color and type of the
-        card.
+        card. It is not stored on the card: it is looked up from the oracle
+        cache when the card is measured, so dealing cards (and games on the
+        ANALYTIC backend) never build circuits or import qiskit.
+    states : int
+        The packed 6-bit codes (color << 4 | type, see Color and Type) of the
+        card's states: bits 0-5 hold the first state, bits 6-11 the second
+        state of a superposition card, and bit 12 is set if there is a second
+        state. knownColor and knownType are decoded from it.
     
     wasMeasured : bool
         A boolean that simply checks if this Card object was measured before
@@ -109,8 +130,27 @@ class Card:
     knownType : Type[]
         A list that represents the type(s) of the card that the Player knows.
         The length of knownType must be the same as the length of knownColor.
+
+    Oracle circuits are shared: every card with the same set of states gets the
+    same cached QuantumCircuit from Card.oracleCircuit(), so qc must never be
+    modified in place.
+
+    Cards use __slots__, so each one only takes a few dozen bytes.
     """
 
+    __slots__ = ("states", "isEntangled", "wasMeasured")
+
+    HAS_SECOND_STATE = 1 << 12
+
+    # Process-wide caches, see oracleCircuit(), groverIterate(), diffuserCircuit() and toffoliTemplate()
+    toffoliQC = None
+    diffuserQC = None
+    oracleCache = OrderedDict()
+    iterateCache = OrderedDict()
+    maxCachedOracles = 512
+    # Held while the caches are read or changed: speculation.py and server.py build circuits on other threads
+    cacheLock = threading.Lock()
+
     # Obtained from Homework 4
     @classmethod
     def recCZa(self, qc, a, Cr, Tr):
@@ -148,35 +188,240 @@ class Card:
         qc.h(Tr)
 
 
-    def initialize_qc(self):
-        """ Initializes the internal quantum circuit to the knownColors/knownTypes
-        
-        Abstractly, this circuit implements an oracle for Grover's algorithm.
+    @classmethod
+    def groverProbabilities(self, stateCodes):
+        """ Computes the exact output distribution of the measurement circuit
+
+        The oracle marks M = len(stateCodes) of the N = 64 basis states, and
+        measure() runs R = floor(pi/4 * sqrt(N/M)) Grover iterations. With
+        sin(theta) = sqrt(M/N), the marked states share a total probability of
+        sin^2((2R+1) * theta) and the unmarked states share the rest, uniformly.
+
+        Returns an array of 64 probabilities indexed by the 6-bit state code
+        (color << 4 | type).
+        """
+        N = 2**6
+        M = len(stateCodes)
+        R = int(np.floor(np.pi * (np.sqrt(N/M)) / 4))
+        theta = np.arcsin(np.sqrt(M/N))
+        markedProb = np.sin((2*R + 1) * theta)**2
+
+        probabilities = np.full(N, (1 - markedProb) / (N - M))
+        probabilities[list(stateCodes)] = markedProb / M
+        return probabilities
+
+
+    # Returns the entry 'key' of the LRU cache 'cache' (or None), marking it as the most recently used
+    @classmethod
+    def cachedCircuit(self, cache, key):
+        with Card.cacheLock:
+            if key in cache:
+                cache.move_to_end(key)
+                return cache[key]
+        return None
+
+
+    # Stores 'value' under 'key' in the LRU cache 'cache', dropping the least recently used entry when full
+    @classmethod
+    def storeCircuit(self, cache, key, value):
+        with Card.cacheLock:
+            cache[key] = value
+            if len(cache) > Card.maxCachedOracles:
+                cache.popitem(last=False)
+
+
+    @classmethod
+    def phaseOracle(self, qc, stateCodes, qubits):
+        """ Flips the sign of the basis states 'stateCodes' of the register 'qubits'
+
+        qubits[0] holds the most significant bit of a state code. The sign
+        flip is a diagonal phase pi * [x is marked], which is expanded over
+        the parities of every subset S of the bits:
+            pi * [x is marked] = const - pi / 2^(n-1) * sum_S c_S * parity_S(x)
+        where c_S = sum over the marked m of (-1)^parity_S(m). The constant is
+        a global phase and is dropped. Each parity is computed into the
+        highest qubit of S with CX gates, in Gray code order so consecutive
+        subsets differ by one CX, and gets a single phase gate.
+
+        For n qubits this takes at most 2^n - 1 phase gates and 2^n - 2 CX
+        gates whatever the number of marked states, instead of a multi-control
+        Toffoli and its X gate sandwich for every marked state. Subsets whose
+        coefficients cancel out get no phase gate.
+        """
+        n = len(qubits)
+        bitQubits = qubits[::-1] # bitQubits[b] holds bit b of a state code
+        for top in range(n):
+            previousGray = 0
+            for step in range(2**top):
+                gray = step ^ (step >> 1)
+                if gray != previousGray:
+                    qc.cx(bitQubits[(gray ^ previousGray).bit_length() - 1], bitQubits[top])
+                previousGray = gray
+
+                subset = gray | (1 << top)
+                coefficient = sum(1 - 2 * (bin(stateCode & subset).count("1") & 1) for stateCode in stateCodes)
+                if coefficient != 0:
+                    qc.p(-np.pi * coefficient / 2**(n-1), bitQubits[top])
+
+            # undo the last parity, which only has the bit below 'top' left
+            if previousGray != 0:
+                qc.cx(bitQubits[previousGray.bit_length() - 1], bitQubits[top])
+
+
+    # Builds the 6-control Toffoli once per process
+    @classmethod
+    def toffoliTemplate(self):
+        if Card.toffoliQC is None:
+            from qiskit import QuantumCircuit
+            toffoliQC = QuantumCircuit(7)
+            Card.recTof(toffoliQC, toffoliQC.qubits[1:7], toffoliQC.qubits[0])
+            Card.toffoliQC = toffoliQC
+        return Card.toffoliQC
+
+
+    @classmethod
+    def toffoliOracleCircuit(self, stateCodes):
+        """ Returns the original oracle circuit marking the given 6-bit state codes
+
         For every card "state" (one state for a non-superposition card, two states
-        for a superposition card) we want this object to represent, we use a
-        multi-qubit Toffoli gate, filtering it out based on the bit representations
-        of the color and type of the card state.
+        for a superposition card), we use a multi-qubit Toffoli gate onto the
+        output qubit, filtering it out based on the bit representations of the
+        color and type of the card state.
+
+        The game uses oracleCircuit() instead; this construction is kept as
+        the reference that benchmark.py compares it against.
         """
-        M = len(self.knownColor)
-        toffoliQC = QuantumCircuit(7)
-        Card.recTof(toffoliQC, toffoliQC.qubits[1:7], toffoliQC.qubits[0])
-
-        for i in range(M):
-            stateColor = self.knownColor[i]
-            stateType = self.knownType[i]
-            stateBinaryStr = np.binary_repr(stateColor.value, width=2) + np.binary_repr(stateType.value, width=4)
+        from qiskit import QuantumCircuit
+        toffoliQC = Card.toffoliTemplate()
+        qc = QuantumCircuit(7) # 1 output + 2 color + 4 type
+        for stateCode in sorted(stateCodes):
+            stateBinaryStr = np.binary_repr(stateCode, width=6)
             xGateIndices = []
             for j in range(len(stateBinaryStr)):
                 if stateBinaryStr[j] == '0':
                     xGateIndices.append(j+1)
             
             if (len(xGateIndices) > 0):
-                self.qc.x(xGateIndices)
+                qc.x(xGateIndices)
 
-            self.qc += toffoliQC
+            qc += toffoliQC
 
             if (len(xGateIndices) > 0):
-                self.qc.x(xGateIndices)
+                qc.x(xGateIndices)
+        return qc
+
+
+    @classmethod
+    def oracleCircuit(self, stateCodes):
+        """ Returns the oracle circuit marking the given 6-bit state codes
+
+        The oracle flips the sign of every card "state" (one state for a
+        non-superposition card, two states for a superposition card) on the
+        color and type qubits 1-6 with a diagonal phase oracle, see
+        phaseOracle(). It acts like the original Toffoli oracle (see
+        toffoliOracleCircuit()) with the output qubit in the |-> state,
+        so qubit 0 is left untouched.
+
+        There are only a few thousand possible state sets, so finished oracles
+        are cached by their sorted state codes. The least recently used oracle
+        is dropped once more than maxCachedOracles are stored.
+        """
+        key = tuple(sorted(stateCodes))
+        qc = Card.cachedCircuit(Card.oracleCache, key)
+        if qc is not None:
+            return qc
+
+        startTime = instrument.start()
+        from qiskit import QuantumCircuit
+        qc = QuantumCircuit(7) # 1 output + 2 color + 4 type
+        Card.phaseOracle(qc, key, qc.qubits[1:7])
+
+        Card.storeCircuit(Card.oracleCache, key, qc)
+        instrument.stop(instrument.ORACLE, startTime)
+        return qc
+
+
+    # Builds the diffuser W of Grover's algorithm once per process: a reflection about the uniform superposition
+    @classmethod
+    def diffuserCircuit(self):
+        if Card.diffuserQC is None:
+            from qiskit import QuantumCircuit
+            W = QuantumCircuit(7)
+            W.h(W.qubits[1:7])
+            Card.phaseOracle(W, [0], W.qubits[1:7]) # reflects about |000000>
+            W.h(W.qubits[1:7])
+            Card.diffuserQC = W
+        return Card.diffuserQC
+
+
+    @classmethod
+    def groverIterate(self, stateCodes):
+        """ Returns the Grover iterate (oracle, then diffuser) as a single 7-qubit gate
+
+        groverCircuit() appends this one gate R times, so the oracle and
+        diffuser instructions are never copied into the measurement circuit.
+        Like the oracles, the gates are cached by their sorted state codes.
+        Each gate is named after its state codes, so circuits with different
+        oracles never share a structural key (see QuantumSession.circuitKey()).
+        """
+        key = tuple(sorted(stateCodes))
+        iterate = Card.cachedCircuit(Card.iterateCache, key)
+        if iterate is not None:
+            return iterate
+
+        # the oracle is timed on its own, so the spans of the two phases never nest
+        oracle = Card.oracleCircuit(key)
+        startTime = instrument.start()
+        from qiskit import QuantumCircuit
+        iterateQC = QuantumCircuit(7, name="grover_" + "_".join(str(stateCode) for stateCode in key))
+        iterateQC.compose(oracle, inplace=True)
+        iterateQC.compose(Card.diffuserCircuit(), inplace=True)
+        iterate = iterateQC.to_gate()
+
+        Card.storeCircuit(Card.iterateCache, key, iterate)
+        instrument.stop(instrument.ORACLE, startTime)
+        return iterate
+
+
+    def initialize_qc(self):
+        """ Returns the internal quantum circuit for the knownColors/knownTypes
+        
+        Abstractly, this circuit implements an oracle for Grover's algorithm.
+        See oracleCircuit() for how it is built.
+        """
+        return Card.oracleCircuit(self.stateCodes())
+
+
+    @property
+    def qc(self):
+        return self.initialize_qc()
+
+
+    # Packs a list of one or two 6-bit state codes into a single int
+    @classmethod
+    def packStates(self, stateCodes):
+        if len(stateCodes) == 1:
+            return stateCodes[0]
+        return stateCodes[0] | (stateCodes[1] << 6) | Card.HAS_SECOND_STATE
+
+
+    # Creates a card directly from its 6-bit state codes, skipping the checks of __init__
+    @classmethod
+    def fromCodes(self, stateCodes, isEntangled=False):
+        newCard = Card.__new__(Card)
+        newCard.states = Card.packStates(stateCodes)
+        newCard.isEntangled = isEntangled
+        newCard.wasMeasured = False
+        return newCard
+
+
+    # Returns a copy of this card
+    def copy(self):
+        newCard = Card.__new__(Card)
+        newCard.states = self.states
+        newCard.isEntangled = self.isEntangled
+        newCard.wasMeasured = self.wasMeasured
+        return newCard
 
 
     def __init__(self, colors, types, isEntangled=False):
@@ -193,19 +438,25 @@ class Card:
               "ERROR in Card.__init__() - The length of 'colors' and 'types' must be greater than 0."
         
         # Quantum properties
-        self.qc = QuantumCircuit(7) # 1 output + 2 color + 4 type
         self.wasMeasured = False
 
         # Known properties
         self.isEntangled = isEntangled # the "isEntangled" prevents the card from being played without wasting a turn
-        self.knownColor = colors
-        self.knownType = types
+        self.states = Card.packStates([(colors[i].value << 4) | types[i].value for i in range(len(colors))])
+
 
-        self.initialize_qc()
+    @property
+    def knownColor(self):
+        return [Color(code >> 4) for code in self.stateCodes()]
 
 
+    @property
+    def knownType(self):
+        return [Type(code & 0b1111) for code in self.stateCodes()]
 
-    def measure(self):
+
+
+    def measure(self, quantumSession=None):
         """ Determines the actual color and type of this card
         
         Since a card's true state is represented by a quantum circuit,
@@ -222,24 +473,84 @@ class Card:
 
         If there are multiple nontrivial measurement results, pick the one that
         had the most number of hits.
+
+        The circuit runs on quantumSession, the game's session.QuantumSession.
+        With Backend.ANALYTIC, no circuit is built: the result is sampled
+        from the closed-form distribution in groverProbabilities().
         Before this method returns:
             Returns a tuple (Color, Type) of the result,
             Sets the knownCard and knownType fields to the result, and
             Sets wasMeasured to True.
         """
-        # W Circuit
-        W = QuantumCircuit(7)
+        if quantumSession is None:
+            quantumSession = session.QuantumSession()
 
-        W.h(W.qubits[1:7])
-        W.x(W.qubits[1:7])
+        batch = quantumSession.batch()
+        pending = self.queueMeasure(batch)
+        batch.run()
+        return pending.result()
+
+
+    # Measures many cards in a single backend job, returns the list of (Color, Type) results
+    @classmethod
+    def measureAll(self, cards, quantumSession):
+        batch = quantumSession.batch()
+        pendings = [c.queueMeasure(batch) for c in cards]
+        batch.run()
+        return [pending.result() for pending in pendings]
 
-        Card.recCZa(W, 1, W.qubits[2:7], W.qubits[1])
 
-        W.x(W.qubits[1:7])
-        W.h(W.qubits[1:7])
+    def queueMeasure(self, batch):
+        """ Queues the measurement of this card on a session.MeasurementBatch
+
+        Returns a session.PendingMeasurement. Once the batch has run, its
+        result() is the (Color, Type) tuple that measure() would return,
+        and this card has collapsed to it.
+        """
+        if batch.session.backend == Backend.ANALYTIC:
+            probabilities = Card.groverProbabilities(self.stateCodes())
+            return batch.addSample(lambda: self.collapse(batch.session.sampleTopOutcome(probabilities)))
+
+        # The circuit is fully determined by the card's states
+        stateCodes = self.stateCodes()
+        key = ("grover",) + tuple(sorted(stateCodes))
+
+        # the bitstrings are the state codes reversed, see topStateCode()
+        def exactProbabilities():
+            return {np.binary_repr(stateCode, width=6)[::-1]: probability
+                    for stateCode, probability in enumerate(Card.groverProbabilities(stateCodes))}
+
+        return batch.addCircuit(self.groverCircuit, key,
+                                lambda counts: self.collapse(Card.topStateCode(counts)), exactProbabilities)
+
+
+    # Sets the known properties to the measured 6-bit state code, returns the (Color, Type) tuple
+    def collapse(self, measuredCode):
+        # Interpret Results
+        measuredColor = Color((measuredCode & 0b110000) >> 4)
+        measuredType = Type(measuredCode & 0b001111)
         
+        self.wasMeasured = True
+        self.states = measuredCode
+        return (measuredColor, measuredType)
+
+
+    def groverCircuit(self):
+        """ Builds the circuit that runs Grover's algorithm on this card's oracle
+
+        The 6 classical bits hold the color and type registers, see measure().
+        The R Grover iterations are R references to the same cached gate from
+        groverIterate(), so once a state set has been seen, building its
+        circuit only appends a couple dozen instructions.
+        """
+        stateCodes = self.stateCodes()
+        iterate = Card.groverIterate(stateCodes) # timed as an oracle build on a cache miss
+
+        startTime = instrument.start()
+        from qiskit import QuantumCircuit
+
         # Looping constant R
-        M = len(self.knownColor)
+        M = len(stateCodes)
         R = int(np.floor(np.pi * (np.sqrt(2**6/M)) / 4))
 
         # Grover's Algorithm
@@ -249,8 +560,7 @@ class Card:
         measureQC.h(range(7))
 
         for _ in range(R):
-            measureQC += self.qc
-            measureQC += W
+            measureQC.append(iterate, measureQC.qubits)
 
         measureQC.h(0)
         measureQC.x(0)
@@ -258,23 +568,27 @@ class Card:
         for i in range(6):
             measureQC.measure(i+1,i)
 
-        # Run it through the Aer Simulator
-        print("   Please wait, our Grover monkeys are doing a lot of quantum magic...")
-        backend = Aer.get_backend('aer_simulator')
-        counts = execute(measureQC, backend, shots=1024).result().get_counts(measureQC) # takes a hot second
+        instrument.stop(instrument.BUILD, startTime)
+        if instrument.enabled:
+            # count the gates inside the iterations too
+            instrument.count(instrument.GATES, measureQC.size() + R * (iterate.definition.size() - 1))
+        return measureQC
+
 
+    # Returns the 6-bit state code (color << 4 | type) with the most hits
+    @classmethod
+    def topStateCode(self, counts):
         # Look at the top result
         topBitString = heapq.nlargest(1, counts.items(), key=itemgetter(1))[0][0]
         correctedBitString = topBitString[::-1]
+        return int(correctedBitString, 2)
 
-        # Interpret Results
-        measuredColor = Color((int(correctedBitString, 2) & 0b110000) >> 4)
-        measuredType = Type(int(correctedBitString, 2) & 0b001111)
-        
-        self.wasMeasured = True
-        self.knownColor = [measuredColor]
-        self.knownType = [measuredType]
-        return (measuredColor, measuredType)
+
+    # The 6-bit codes (color << 4 | type) of every state this card can be in
+    def stateCodes(self):
+        if self.states & Card.HAS_SECOND_STATE:
+            return [self.states & 0b111111, (self.states >> 6) & 0b111111]
+        return [self.states]
 
 
     # Given a colortype tuple, checks if this card matches and can be played
@@ -286,12 +600,12 @@ class Card:
 
         topColor, topType = colorTypeTuple
         # as long as one of the types/colors of the card matches, you can play it
-        for col in self.knownColor:
-            if col == topColor:
+        for code in self.stateCodes():
+            if code >> 4 == topColor.value:
                 return True
         
-        for typ in self.knownType:
-            if typ == topType:
+        for code in self.stateCodes():
+            if code & 0b1111 == topType.value:
                 return True
         
         # nothing matches, so return false.
@@ -335,7 +649,7 @@ class Card:
             game.deck.addRYPhase()
 
         if entanglingCard is not None:
-            nextPlayer.cards.append(entanglingCard)
+            nextPlayer.addCard(entanglingCard)
             return playedCard
         
         return None
@@ -1,9 +1,7 @@
-from random import random, randint
 import heapq
 from operator import itemgetter
-from qiskit import QuantumCircuit, Aer, execute
 import numpy as np
-import card
+import card, instrument, session
 
 class Deck:
     """ Generates random cards for the players to have
@@ -21,8 +19,47 @@ class Deck:
     store the quantum circuit of the first color in deckColors. We
     also create a mapping from the possible first colors to the second
     colors.
+
+    The deck also holds the game's session.QuantumSession, which runs
+    every quantum measurement of the game (card plays included) on one
+    shared simulator. The deck's own circuits only need 2 qubits, so every
+    backend other than AER runs them on the NumPy statevector simulator.
+    The ANALYTIC backend samples them from their exact distributions instead.
+
+    The color circuit is only built when the top card is measured on a
+    circuit backend, see colorCircuit(). Since RY(4 * pi/2) is the identity
+    (up to a global phase), the state of the top card only depends on
+    its first color and its phase index (ryGateCount % 4). The outcome of
+    every (first color, phase) pair is precomputed in PHASE_PROBABILITIES,
+    and the color circuit holds a single RY gate, so drawing costs the same
+    no matter how many Add Phase cards were played.
+
+    New cards are generated from the deck's own numpy Generator (rng) in
+    vectorized blocks, so a deck created with a seed always deals the same
+    cards.
     """
 
+    # Chances that a new card is a Make Entangled card or a superposition card
+    probOfMakeEntangled = 0.2
+    probOfSuperposition = 0.5
+
+    # How many cards are generated at once
+    cardBlockSize = 256
+
+    # RY(k * pi/2) flips the color[0] qubit with probability sin^2(k * pi/4), for each phase index k
+    PHASE_FLIP_PROBABILITIES = np.sin(np.arange(4) * np.pi / 4)**2
+
+    # PHASE_PROBABILITIES[firstColor][phase] - the distribution of the measured first color,
+    # indexed by the Color value. Flipping color[0] gives the opposite color (value ^ 1).
+    PHASE_PROBABILITIES = np.zeros((4, 4, 4))
+    for firstColor in range(4):
+        PHASE_PROBABILITIES[firstColor, :, firstColor] = 1 - PHASE_FLIP_PROBABILITIES
+        PHASE_PROBABILITIES[firstColor, :, firstColor ^ 1] = PHASE_FLIP_PROBABILITIES
+    del firstColor
+
+    # The measured color circuit of every (first color, phase) pair, built on first use
+    colorCircuits = {}
+
     # Initializes the internal circuit
     def initColorCircuit(self):
         firstColor = self.deckColors[0]
@@ -47,136 +84,264 @@ class Deck:
     # resets the top card
     def resetTopCard(self):
         newColors, newTypes = self.newCard()
+        self.setTopCard(newColors, newTypes)
+
 
+    # Replaces the top card with the given colors/types, without any phase
+    def setTopCard(self, newColors, newTypes):
         # stores the "true state" of the top card
         self.deckColors = newColors
         self.deckTypes = newTypes
         
         assert len(self.deckColors) == len(self.deckTypes)
 
-        self.colorQC = QuantumCircuit(2, 2)
-        self.initColorCircuit()
-
+        self.colorQC = None # built by colorCircuit()
 
         self.initColorDictionary()
         # stores each potential color in a tuple, one for each state.
         # example: Red/Green superposition card with RY phase pi/2
         #           topOfDeckColor should store (Red, Green), (Blue, Yellow)
-        self.ryGateCount = 0 #for printing purposes
-        self.topOfDeckColor = []
-        if len(self.deckColors) > 1:
-            self.topOfDeckColor = [(self.deckColors[0], self.deckColors[1])]
-        else:
-            self.topOfDeckColor = [(self.deckColors[0], None)]
+        self.topCardVersion += 1 # changes whenever the distribution of the next draw may change
+        self.ryGateCount = 0 # number of RY(pi/2) phases added to the top card
+        self.phase = 0 # ryGateCount % 4, the only part of the phase that changes the state
+        self.topOfDeckColor = self.phaseColors(0)
 
 
 
-    def __init__(self):
+    def __init__(self, quantumSession=None, seed=None):
+        self.rng = np.random.default_rng(seed)
+        self.cardBuffer = []
+        self.topCardVersion = 0
+        self.session = quantumSession if quantumSession is not None else session.QuantumSession()
         self.resetTopCard()
 
     
+    def fork(self, quantumSession, seed=None):
+        """ Returns a copy of this deck for a forked game, see GameEngine.fork()
+
+        The top card is shared, since it is only ever replaced and never
+        changed in place. Without a seed, the fork copies the generator and
+        the buffered cards, so it deals the same cards as this deck. With
+        a seed, it deals new random cards from a generator seeded by it.
+        """
+        forked = Deck.__new__(Deck)
+        forked.__dict__.update(self.__dict__)
+        forked.session = quantumSession
+        if seed is None:
+            forked.rng = session.copyGenerator(self.rng)
+            forked.cardBuffer = list(self.cardBuffer)
+        else:
+            forked.rng = np.random.default_rng(seed)
+            forked.cardBuffer = []
+        return forked
+
+
     # For the action method, adding the RY gate to color[0] and updates the topofDeckColor tuple
     def addRYPhase(self):
         self.ryGateCount += 1
-        self.colorQC.ry(np.pi / 2, 0)
+        self.topCardVersion += 1
+        self.phase = (self.phase + 1) % 4
+        self.topOfDeckColor = self.phaseColors(self.phase)
 
-        if self.ryGateCount % 4 == 0:
-            if len(self.deckColors) > 1:
-                self.topOfDeckColor = [(self.deckColors[0], self.deckColors[1])]
-            else:
-                self.topOfDeckColor = [(self.deckColors[0], None)]
 
-        elif self.ryGateCount % 4 == 1 or self.ryGateCount % 4 == 3:
-            if len(self.deckColors) > 1:
-                self.topOfDeckColor = [(self.deckColors[0], self.deckColors[1]), \
-                                    (self.deckColors[0].getOppositeColor(), self.deckColors[1].getOppositeColor())]
-            else:
-                self.topOfDeckColor = [(self.deckColors[0], None), \
-                                    (self.deckColors[0].getOppositeColor(), None)]
-        elif self.ryGateCount % 4 == 2:
-            if len(self.deckColors) > 1:
-                self.topOfDeckColor = [(self.deckColors[0].getOppositeColor(), self.deckColors[1].getOppositeColor())]
-            else:
-                self.topOfDeckColor = [(self.deckColors[0].getOppositeColor(), None)]
+    # The possible (first, second) colors of the top card at the given phase index
+    def phaseColors(self, phase):
+        original = (self.deckColors[0], self.deckColors[1] if len(self.deckColors) > 1 else None)
+        flipped = (original[0].getOppositeColor(), original[1].getOppositeColor() if original[1] is not None else None)
+
+        if phase == 0:
+            return [original]
+        elif phase == 2:
+            return [flipped]
+        return [original, flipped]
+
+
+    # Builds the color circuit of the top card: its first color followed by RY(phase * pi/2)
+    def colorCircuit(self):
+        from qiskit import QuantumCircuit
+        self.colorQC = QuantumCircuit(2, 2)
+        self.initColorCircuit()
+        if self.phase > 0:
+            self.colorQC.ry(self.phase * np.pi / 2, 0)
+        return self.colorQC
+
+
+    # The exact distribution of the measured first color, indexed by the Color value
+    def colorProbabilities(self):
+        return Deck.PHASE_PROBABILITIES[self.deckColors[0].value, self.phase]
+
+
+    # The 6-bit state codes of the top card, before any phase is applied
+    def topCardCodes(self):
+        return [(self.deckColors[i].value << 4) | self.deckTypes[i].value for i in range(len(self.deckColors))]
 
 
     # Returns the top card and resets it
     def getTopCard(self):
-        # measure the color circuit
-        self.colorQC.measure(0, 0)
-        self.colorQC.measure(1, 1)
+        batch = self.session.batch()
+        pending = self.queueTopCard(batch)
+        batch.run()
+        return pending.result()
 
-        backend = Aer.get_backend('aer_simulator')
-        counts = execute(self.colorQC, backend, shots=1024).result().get_counts(self.colorQC) # takes a hot second
 
-        topBitString = heapq.nlargest(1, counts.items(), key=itemgetter(1))[0][0]
-        measuredColor = [card.Color(int(topBitString, 2))]
+    # Draws 'count' cards from the top of the deck in a single backend job
+    def drawMany(self, count):
+        batch = self.session.batch()
+        pendings = [self.queueTopCard(batch) for _ in range(count)]
+        batch.run()
+        return [pending.result() for pending in pendings]
 
-        if len(self.deckColors) > 1:
-            measuredColor.append(self.colorDict[measuredColor[0]])
 
-        topCard = card.Card(measuredColor, self.deckTypes)
+    def queueTopCard(self, batch):
+        """ Queues the measurement of the top card on a session.MeasurementBatch
 
-        # reset top card
-        self.resetTopCard()
+        The top card is reset right away, so the next queued draw measures
+        the new top card. Returns a session.PendingMeasurement whose result()
+        is the drawn Card once the batch has run.
+        """
+        deckColors = self.deckColors
+        deckTypes = self.deckTypes
+        colorDict = self.colorDict
+
+        def decode(measuredValue):
+            measuredColor = [card.Color(measuredValue)]
+
+            if len(deckColors) > 1:
+                measuredColor.append(colorDict[measuredColor[0]])
 
-        return topCard
+            return card.Card(measuredColor, deckTypes)
 
+        if batch.session.backend == card.Backend.ANALYTIC:
+            probabilities = self.colorProbabilities()
+            pending = batch.addSample(lambda: decode(batch.session.sampleTopOutcome(probabilities)))
+        else:
+            # measure the color circuit, which is the same for every top card with this first color and phase
+            # server.py and speculation.py draw on other threads, so new circuits are stored under Card.cacheLock
+            key = ("deck", self.deckColors[0], self.phase)
+            colorQC = Deck.colorCircuits.get(key)
+            if colorQC is None:
+                startTime = instrument.start()
+                self.colorCircuit()
+                self.colorQC.measure(0, 0)
+                self.colorQC.measure(1, 1)
+                with card.Card.cacheLock:
+                    colorQC = Deck.colorCircuits.setdefault(key, self.colorQC)
+                instrument.stop(instrument.BUILD, startTime)
+                instrument.count(instrument.GATES, self.colorQC.size())
+            self.colorQC = colorQC
+
+            def decodeCounts(counts):
+                topBitString = heapq.nlargest(1, counts.items(), key=itemgetter(1))[0][0]
+                return decode(int(topBitString, 2))
+
+            colorProbabilities = self.colorProbabilities()
+            def probabilities():
+                return {np.binary_repr(colorValue, width=2): probability
+                        for colorValue, probability in enumerate(colorProbabilities)}
+
+            pending = batch.addCircuit(self.colorQC, key, decodeCounts, probabilities)
 
-    # Adds a color enum to the given colorArray
-    def addColor(self, colorArray):
-        color = randint(0, 3)
-        colorArray.append(card.Color(color))
+        # reset top card
+        self.resetTopCard()
+
+        return pending
 
 
     # Adds a type enum to the given type array
     def addType(self, typeArray, isMakeEntangled):
         if not isMakeEntangled:
-            type = randint(0, 9) # 0-10 inclusive
+            type = int(self.rng.integers(0, 10)) # 0-9 inclusive
         else:
-            type = randint(10, 15) # 10-15 inclusive
+            type = int(self.rng.integers(10, 16)) # 10-15 inclusive
 
         typeArray.append(card.Type(type))
 
 
-    def newCard(self):
-        """ Creates a new random card for self.topOfDeckColor.
-        The Card() constructor will generate the internal quantum
-        circuit. This method must simply specify the various colors
-        and types the new Deck card will have.
+    @classmethod
+    def generateCards(self, rng, count, probOfMakeEntangled, probOfSuperposition):
+        """ Generates 'count' random cards at once with the numpy Generator 'rng'
 
-        Returns the tuple (colors, types, isMakeEntangled) for the new card.
+        Follows the same rules as drawing the cards one at a time:
+        a card is a Make Entangled card with probability probOfMakeEntangled,
+        otherwise it is a superposition card with probability probOfSuperposition,
+        and the two states of a superposition card never share a type.
 
-        See Card class for the specifications on knownColors and knownTypes.
+        Returns the arrays (first, second) of 6-bit state codes (color << 4 | type),
+        where second is -1 for cards that are not superposition cards.
         """
+        isMakeEntangled = rng.random(count) < probOfMakeEntangled
+        # I do not want superposition cards to be make entangled cards
+        isSuperposition = (rng.random(count) < probOfSuperposition) & ~isMakeEntangled
 
-        probOfMakeEntangled = 0.2
-        probOfSuperposition = 0.5
-        isMakeEntangled = random() < probOfMakeEntangled
-        isSuperposition = random() < probOfSuperposition
+        firstType = np.where(isMakeEntangled, rng.integers(10, 16, count), rng.integers(0, 10, count))
+        first = (rng.integers(0, 4, count) << 4) | firstType
 
-        knownColors = []
-        knownTypes = []
-        self.addColor(knownColors)
-        self.addType(knownTypes, isMakeEntangled)
+        # Ensure that a card is not a duplicate of itself: the second type is
+        # uniform over the other 9 number/AddPhase types
+        secondType = rng.integers(0, 9, count)
+        secondType += secondType >= firstType
+        second = (rng.integers(0, 4, count) << 4) | secondType
+        second = np.where(isSuperposition, second, -1)
 
-        # I do not want superposition cards to be make entangled cards
-        if isSuperposition and not isMakeEntangled:
-            self.addColor(knownColors)
-            temporaryTypes = []
-            self.addType(temporaryTypes, False)
+        return (first, second)
+
+
+    # Refills the card buffer with a new block of cards
+    def refillCards(self):
+        first, second = Deck.generateCards(self.rng, self.cardBlockSize,
+                                           self.probOfMakeEntangled, self.probOfSuperposition)
+        # reversed, so that pop() hands the cards out in the order they were generated
+        self.cardBuffer = list(zip(first.tolist(), second.tolist()))[::-1]
+
+
+    # Returns the 6-bit state codes of a new random card, see newCard()
+    def newCardCodes(self):
+        if len(self.cardBuffer) == 0:
+            self.refillCards()
+
+        first, second = self.cardBuffer.pop()
+        if second < 0:
+            return [first]
+        return [first, second]
+
+
+    def newCard(self):
+        """ Creates a new random card for self.topOfDeckColor.
+        The Card() constructor only stores the card's packed state codes;
+        its quantum circuit is not built until the card is measured. This
+        method must simply specify the various colors and types the new
+        Deck card will have.
 
-            # Ensure that a card is not a duplicate of itself
-            while temporaryTypes[0] in knownTypes:
-                temporaryTypes = []
-                self.addType(temporaryTypes, False)
-            knownTypes.append(temporaryTypes[0])
+        Cards are generated in blocks of cardBlockSize by generateCards()
+        and handed out one at a time from the deck's buffer.
 
+        Returns the tuple (colors, types) for the new card.
+
+        See Card class for the specifications on knownColors and knownTypes.
+        """
+        stateCodes = self.newCardCodes()
+        knownColors = [card.Color(code >> 4) for code in stateCodes]
+        knownTypes = [card.Type(code & 0b1111) for code in stateCodes]
         return (knownColors, knownTypes)
 
 
     def newEntangled(self, cardColor):
         """ Creates an entangled pair of cards for the caller
+        
+        See queueEntangled() for the details. This runs the
+        measurement right away and returns its result.
+        """
+        batch = self.session.batch()
+        pending = self.queueEntangled(batch, cardColor)
+        batch.run()
+        return pending.result()
+
+
+    def queueEntangled(self, batch, cardColor):
+        """ Queues the creation of an entangled pair on a session.MeasurementBatch
+
+        Returns a session.PendingMeasurement. Once the batch has run, its
+        result() is the tuple described below.
 
         This function returns a tuple of two elements:
             [0] - A tuple of Color/Type, representing the output
@@ -200,27 +365,6 @@ class Deck:
         bit 0: the original player receives cardColor[1] and then knows that
         the next player has cardColor[0].
         """
-        # use entanglement to emulate card color entanglement
-        qc = QuantumCircuit(2, 1)
-        qc.h(0)
-        qc.x(1)
-        qc.cx(0, 1)
-        qc.measure(0, 0)
-        backend = Aer.get_backend('aer_simulator')
-        counts = execute(qc, backend, shots=1024).result().get_counts(qc)
-        topBitString = heapq.nlargest(1, counts.items(), key=itemgetter(1))[0][0]
-
-        currCardColor = None
-        nextCardColor = None
-        if topBitString == '0':
-            currCardColor = cardColor[0]
-            nextCardColor = cardColor[1]
-        elif topBitString == '1':
-            currCardColor = cardColor[1]
-            nextCardColor = cardColor[0]
-        else:
-            assert False
-
         # the first player already "measured" their card
         currCardType = []
         self.addType(currCardType, False)
@@ -228,6 +372,40 @@ class Deck:
         # the next player has not "measured" their card yet
         nextCardType = []
         self.addType(nextCardType, False)
-        
-        return ((currCardColor, currCardType[0]), \
-            card.Card([nextCardColor], nextCardType, isEntangled=True))
+
+        def decode(topBitString):
+            currCardColor = None
+            nextCardColor = None
+            if topBitString == '0':
+                currCardColor = cardColor[0]
+                nextCardColor = cardColor[1]
+            elif topBitString == '1':
+                currCardColor = cardColor[1]
+                nextCardColor = cardColor[0]
+            else:
+                assert False
+            
+            return ((currCardColor, currCardType[0]), \
+                card.Card([nextCardColor], nextCardType, isEntangled=True))
+
+        if batch.session.backend == card.Backend.ANALYTIC:
+            # measuring qubit 0 of the bell state gives 0 or 1 with equal probability
+            return batch.addSample(lambda: decode(str(batch.session.sampleTopOutcome([0.5, 0.5]))))
+
+        # use entanglement to emulate card color entanglement
+        def bellCircuit():
+            startTime = instrument.start()
+            from qiskit import QuantumCircuit
+            qc = QuantumCircuit(2, 1)
+            qc.h(0)
+            qc.x(1)
+            qc.cx(0, 1)
+            qc.measure(0, 0)
+            instrument.stop(instrument.BUILD, startTime)
+            instrument.count(instrument.GATES, qc.size())
+            return qc
+
+        # the circuit is only built if its distribution is not cached yet
+        # qubit 0 of the bell state is measured as 0 or 1 with equal probability
+        return batch.addCircuit(bellCircuit, ("entangle",), lambda counts:
+            decode(heapq.nlargest(1, counts.items(), key=itemgetter(1))[0][0]), lambda: {"0": 0.5, "1": 0.5})
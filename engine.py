@@ -0,0 +1,326 @@
+import numpy as np
+import card
+import player
+import deck
+import session
+import gamelog
+
+class TurnResult:
+    """ Describes what happened during one call to GameEngine.step()
+
+    Attributes
+    --------------
+    playerIndex : int
+        The index of the player who took the turn.
+    action : int
+        The action that was taken, see GameEngine.legal_actions().
+    playedCard : Card
+        The card played from the hand, or None if the player drew a card.
+        An entangled card that was only measured (a wasted turn) counts as played.
+    wasSuperposition : bool
+        True if playedCard was a superposition card before it was measured.
+    measuredResult : (Color, Type)
+        The measured color and type of playedCard, or None if nothing was measured.
+    drawnCard : Card
+        The card drawn from the deck, or None.
+    entangledCard : Card
+        The entangled card handed to the next player by a Make Entangled card, or None.
+    isOver : bool
+        True if this turn won the game.
+    """
+
+    def __init__(self, playerIndex, action):
+        self.playerIndex = playerIndex
+        self.action = action
+        self.playedCard = None
+        self.wasSuperposition = False
+        self.measuredResult = None
+        self.drawnCard = None
+        self.entangledCard = None
+        self.isOver = False
+
+
+
+class GameEngine:
+    """ The rules of QUNO without any user interface
+
+    The engine owns the deck, the players and the played pile, and
+    advances the game one turn at a time through step(). It never
+    reads input or prints anything, so bots, tests and simulations
+    can drive it directly. The console game in quno.py is a client
+    of this class.
+
+    A seed makes the dealt cards and every sampled measurement
+    reproducible (except on the AER backend, which has its own RNG).
+
+    If a gamelog.GameLog is given, every deal, play, draw, measurement
+    outcome, entangled pair and AddPhase is recorded in it, so that
+    gamelog.replay() can rebuild any intermediate state of the game.
+    The log is closed when the game is over.
+
+    Attributes
+    --------------
+    players : Player[]
+        The players of the game, in turn order.
+    playerIndex : int
+        The index of the player whose turn it is.
+    topOfPlayedPile : (Color, Type)
+        The last played card, or None if no card was played yet.
+    deck : Deck
+        The deck that the players draw from.
+    session : QuantumSession
+        Runs every quantum measurement of the game.
+    winner : int
+        The index of the player who won, or None while the game is running.
+    turnCount : int
+        The number of turns played so far.
+    log : GameLog
+        The event log of the game, or None.
+    history : tuple[]
+        The actionKey() of every turn played so far, in order.
+    publicHistory : tuple[]
+        The (playerIndex, publicKey()) of every turn played so far, in order:
+        what the other players saw of it.
+    """
+
+    # The action for drawing the top card of the deck
+    DRAW = -1
+
+    def __init__(self, numPlayers, backend=None, seed=None, log=None, dealHands=True):
+        self.playerIndex = 0
+        self.players = []
+        self.topOfPlayedPile = None
+        self.winner = None
+        self.turnCount = 0
+        self.log = log
+        self.history = []
+        self.publicHistory = []
+
+        # One quantum session is shared by every measurement of the game.
+        # The session and the deck get independent random streams from the seed.
+        sessionSeed, deckSeed = np.random.SeedSequence(seed).spawn(2)
+        self.session = session.QuantumSession(backend, seed=sessionSeed)
+        self.deck = deck.Deck(self.session, seed=deckSeed)
+
+        self.initialize_players(numPlayers, dealHands)
+
+        if self.log is not None:
+            self.log.record(gamelog.START, numPlayers)
+            for i, currentPlayer in enumerate(self.players):
+                for heldCard in currentPlayer.cards:
+                    self.log.record(gamelog.DEAL, i, heldCard.stateCodes())
+            self.log.record(gamelog.DECK, self.deck.topCardCodes())
+
+
+    # Creates the player objects
+    def initialize_players(self, numPlayers, dealHands=True):
+        for i in range(numPlayers):
+            self.players.append(player.Player(i+1, self.deck, dealHands))
+
+
+    def currentPlayer(self):
+        return self.players[self.playerIndex]
+
+
+    def nextPlayerIndex(self):
+        return (self.playerIndex + 1) % len(self.players)
+
+
+    def isOver(self):
+        return self.winner is not None
+
+
+    def legal_actions(self):
+        """ Returns the actions the current player can take
+
+        An action is either the index of a playable card in the current
+        player's hand, or GameEngine.DRAW to draw the top card of the deck.
+        Entangled cards can always be chosen; doing so measures the card
+        and uses up the turn.
+        """
+        if self.isOver():
+            return []
+
+        actions = self.currentPlayer().playableIndices(self.topOfPlayedPile)
+        actions.append(GameEngine.DRAW)
+        return actions
+
+
+    def actionKey(self, action):
+        """ Describes 'action' of the current player without using its hand index
+
+        Drawing is ("draw",), and playing a card is ("play", isEntangled, states)
+        with the packed states of the card (see Card.packStates()). Unlike
+        hand indices, keys stay the same when the hand changes, so they can
+        name the same move across different games, e.g. in a search tree.
+        The states of an unmeasured entangled card are hidden even from its
+        owner, so measuring one is ("play", True, None).
+        """
+        if action == GameEngine.DRAW:
+            return ("draw",)
+        heldCard = self.currentPlayer().cards[action]
+        if heldCard.isEntangled:
+            return ("play", True, None)
+        return ("play", False, heldCard.states)
+
+
+    @classmethod
+    def publicKey(self, result):
+        """ Describes the turn of a TurnResult as the other players saw it
+
+        Drawing is ("draw",), measuring an entangled card is ("reveal",) and
+        playing a card is ("play", code) with the measured 6-bit state code
+        (color << 4 | type): which card of the hand was played, and whether
+        it was a superposition, stays hidden.
+        """
+        if result.drawnCard is not None:
+            return ("draw",)
+        if result.measuredResult is None:
+            return ("reveal",)
+        measuredColor, measuredType = result.measuredResult
+        return ("play", (measuredColor.value << 4) | measuredType.value)
+
+
+    def fork(self, seed=None, backend=None):
+        """ Returns an independent copy of the game
+
+        Moves played on the fork do not change this game, and the other way
+        around. The fork shares everything a move does not change in place:
+        the hands are shared with copy-on-write players (see Player.fork()),
+        cards and the top card of the deck are never changed in place, and
+        the circuit caches of the session are shared. Only the turn history
+        and the random number generators are copied.
+
+        Without a seed, the fork deals and measures exactly like this game
+        would (except on the AER backend). With a seed, it draws new random
+        cards and outcomes from it. 'backend' switches the fork to another
+        backend, e.g. ANALYTIC for fast what-if rollouts of an AER game.
+        The fork does not write to the log of this game.
+        """
+        if seed is not None:
+            sessionSeed, deckSeed = np.random.SeedSequence(seed).spawn(2)
+        else:
+            sessionSeed, deckSeed = None, None
+
+        forked = self.__class__.__new__(self.__class__)
+        forked.__dict__.update(self.__dict__)
+        forked.session = self.session.fork(sessionSeed, backend)
+        forked.deck = self.deck.fork(forked.session, deckSeed)
+        forked.players = [p.fork(forked.deck) for p in self.players]
+        forked.history = list(self.history)
+        forked.publicHistory = list(self.publicHistory)
+        forked.log = None
+        return forked
+
+
+    # Returns the first action of the current player with the given actionKey(), or None
+    def actionForKey(self, key):
+        for action in self.legal_actions():
+            if self.actionKey(action) == key:
+                return action
+        return None
+
+
+    def step(self, action, measured=None):
+        """ Plays one turn of the current player
+
+        Applies 'action' (see legal_actions()), checks the win/UNO conditions
+        and passes the turn to the next player unless the game was won.
+        Returns a TurnResult describing the turn.
+
+        'measured' is an outcome that was already measured for this action,
+        e.g. by a speculation.Speculator: the (Color, Type) of the played
+        card, or the Card drawn from the current top of the deck. The turn
+        then uses it instead of measuring again.
+        """
+        # State checks
+        assert not self.isOver(), \
+              "ERROR in GameEngine.step() - The game is already over."
+        # Parameter checks
+        assert action in self.legal_actions(), \
+              "ERROR in GameEngine.step() - " + str(action) + " is not a legal action."
+
+        currentPlayer = self.currentPlayer()
+        nextPlayer = self.players[self.nextPlayerIndex()]
+        result = TurnResult(self.playerIndex, action)
+        self.history.append(self.actionKey(action))
+
+        if action == GameEngine.DRAW:
+            if measured is None:
+                result.drawnCard = self.deck.getTopCard()
+            else:
+                result.drawnCard = measured
+                self.deck.resetTopCard()
+            currentPlayer.addCard(result.drawnCard)
+            if self.log is not None:
+                self.log.record(gamelog.DRAW, self.playerIndex, result.drawnCard.stateCodes())
+                self.log.record(gamelog.DECK, self.deck.topCardCodes())
+        else:
+            playedCard = currentPlayer.cards[action]
+            result.playedCard = playedCard
+
+            if playedCard.isEntangled == True:
+                # measuring an entangled card wastes the turn
+                result.playedCard = currentPlayer.revealCard(playedCard)
+                if self.log is not None:
+                    self.log.record(gamelog.REVEAL, self.playerIndex, action)
+            else:
+                # The card leaves the hand before it is measured, since hands may be shared with forks
+                currentPlayer.removeCard(playedCard)
+                playedCard = playedCard.copy()
+                result.playedCard = playedCard
+
+                # Collapse superposition (if there was one)
+                result.wasSuperposition = len(playedCard.knownColor) > 1
+                if measured is None:
+                    result.measuredResult = playedCard.measure(self.session)
+                else:
+                    measuredColor, measuredType = measured
+                    result.measuredResult = playedCard.collapse((measuredColor.value << 4) | measuredType.value)
+                self.topOfPlayedPile = result.measuredResult
+
+                # Do the card's action
+                nextHandSize = len(nextPlayer.cards)
+                actionReturn = playedCard.action(nextPlayer, self)
+                if actionReturn is not None:
+                    self.topOfPlayedPile = actionReturn
+                if len(nextPlayer.cards) > nextHandSize:
+                    result.entangledCard = nextPlayer.cards[-1]
+
+                if self.log is not None:
+                    self.log.record(gamelog.PLAY, self.playerIndex, action, playedCard.stateCodes()[0])
+                    if result.measuredResult[1] == card.Type.ADD_PHASE:
+                        self.log.record(gamelog.PHASE)
+                    if result.entangledCard is not None:
+                        topColor, topType = self.topOfPlayedPile
+                        self.log.record(gamelog.ENTANGLE, self.nextPlayerIndex(), (topColor.value << 4) | topType.value,
+                                        result.entangledCard.stateCodes()[0])
+
+        self.publicHistory.append((self.playerIndex, GameEngine.publicKey(result)))
+        if self.log is not None:
+            self.log.record(gamelog.END)
+        result.isOver = self.endTurn()
+        if result.isOver and self.log is not None:
+            self.log.close()
+        return result
+
+
+    def endTurn(self):
+        """ Checks the win/UNO conditions and passes the turn to the next player
+
+        Returns True if the current player won the game.
+        """
+        currentPlayer = self.currentPlayer()
+        self.turnCount += 1
+
+        # Check win/UNO condition
+        if len(currentPlayer.cards) == 0:
+            self.winner = self.playerIndex
+            return True
+        elif len(currentPlayer.cards) == 1:
+            currentPlayer.hasUNO = True
+        else:
+            currentPlayer.hasUNO = False
+
+        self.playerIndex = self.nextPlayerIndex()
+        return False
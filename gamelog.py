@@ -0,0 +1,145 @@
+""" Event log of a QUNO game, and a fast replayer for it
+
+A GameEngine created with a GameLog records every event that changes the
+game state, together with the outcome of every quantum measurement. Since
+the outcomes are stored, replay() rebuilds the state of the game after any
+turn without simulating a single circuit.
+
+Every event is a tuple whose first element is its kind. Cards are stored as
+lists of their 6-bit state codes (color << 4 | type), see Card.stateCodes().
+
+    (START, numPlayers)                           a new game
+    (DEAL, playerIndex, codes)                    a card dealt to a starting hand
+    (DECK, codes)                                 a new top card of the deck
+    (DRAW, playerIndex, codes)                    the measured top card of the deck was drawn
+    (REVEAL, playerIndex, handIndex)              an entangled card was measured (a wasted turn)
+    (PLAY, playerIndex, handIndex, code)          a card was played and measured to 'code'
+    (PHASE,)                                      an RY(pi/2) phase was added to the top of the deck
+    (ENTANGLE, nextPlayerIndex, topCode, code)    a Make Entangled card put 'topCode' on the played
+                                                  pile and gave the next player the entangled 'code'
+    (END,)                                        the end of a turn
+
+A log can also be streamed to a JSON-lines file, one event per line. The
+file is line buffered, so every event is on disk as soon as it is recorded
+and a crash loses at most the event being written.
+"""
+import json
+import card
+import engine
+
+START = "start"
+DEAL = "deal"
+DECK = "deck"
+DRAW = "draw"
+REVEAL = "reveal"
+PLAY = "play"
+PHASE = "phase"
+ENTANGLE = "entangle"
+END = "end"
+
+
+class GameLog:
+    """ An append-only list of game events
+
+    Attributes
+    --------------
+    events : tuple[]
+        The recorded events, in order.
+    path : str
+        The JSON-lines file every event is appended to, or None.
+    """
+
+    def __init__(self, path=None):
+        self.events = []
+        self.path = path
+        self.file = open(path, "a", buffering=1) if path is not None else None
+
+
+    def record(self, *event):
+        self.events.append(event)
+        if self.file is not None:
+            self.file.write(json.dumps(event) + "\n")
+
+
+    # Closes the file, the events stay in memory; GameEngine calls it when the game is over
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+    # The number of complete turns in the log
+    def turnCount(self):
+        return sum(1 for event in self.events if event[0] == END)
+
+
+    # Reads a log written to a JSON-lines file
+    @classmethod
+    def load(self, path):
+        log = GameLog()
+        with open(path) as logFile:
+            for line in logFile:
+                if line.strip():
+                    log.events.append(tuple(json.loads(line)))
+        return log
+
+
+
+def decodeState(code):
+    return (card.Color(code >> 4), card.Type(code & 0b1111))
+
+
+def setDeckTopCard(game, codes):
+    game.deck.setTopCard([card.Color(code >> 4) for code in codes], [card.Type(code & 0b1111) for code in codes])
+
+
+def replay(log, turns=None):
+    """ Rebuilds the game recorded in 'log'
+
+    Applies the events of the first 'turns' turns (every turn if None)
+    and returns the resulting engine.GameEngine. The game uses the
+    ANALYTIC backend, so it can be continued with step() afterwards.
+    No quantum circuit is built or simulated during the replay.
+    """
+    events = log.events
+    assert len(events) > 0 and events[0][0] == START, \
+          "ERROR in replay() - The log does not start with a START event."
+
+    game = engine.GameEngine(events[0][1], card.Backend.ANALYTIC, dealHands=False)
+    for event in events[1:]:
+        kind = event[0]
+        # the dealt cards and the first top card of the deck come before the first turn
+        if turns is not None and game.turnCount >= turns and kind not in (DEAL, DECK):
+            break
+
+        if kind == DEAL:
+            game.players[event[1]].addCard(card.Card.fromCodes(event[2]))
+        elif kind == DECK:
+            setDeckTopCard(game, event[1])
+        elif kind == DRAW:
+            game.history.append(game.actionKey(engine.GameEngine.DRAW))
+            game.publicHistory.append((event[1], ("draw",)))
+            game.players[event[1]].addCard(card.Card.fromCodes(event[2]))
+        elif kind == REVEAL:
+            game.history.append(game.actionKey(event[2]))
+            game.publicHistory.append((event[1], ("reveal",)))
+            currentPlayer = game.players[event[1]]
+            currentPlayer.revealCard(currentPlayer.cards[event[2]])
+        elif kind == PLAY:
+            game.history.append(game.actionKey(event[2]))
+            game.publicHistory.append((event[1], ("play", event[3])))
+            currentPlayer = game.players[event[1]]
+            playedCard = currentPlayer.cards[event[2]]
+            currentPlayer.removeCard(playedCard)
+            game.topOfPlayedPile = playedCard.collapse(event[3])
+        elif kind == PHASE:
+            game.deck.addRYPhase()
+        elif kind == ENTANGLE:
+            game.topOfPlayedPile = decodeState(event[2])
+            game.players[event[1]].addCard(card.Card.fromCodes([event[3]], isEntangled=True))
+        elif kind == END:
+            game.endTurn()
+        else:
+            assert False, "ERROR in replay() - Unknown event '" + str(kind) + "'."
+
+    return game
@@ -0,0 +1,180 @@
+""" Switchable instrumentation of the hot paths of QUNO
+
+When a turn feels slow, the time can go into building oracles and
+Grover circuits (timed as separate phases, their spans never nest), the backend running them, decoding the counts or
+redrawing the console. While enabled, every phase records how often it
+ran and a histogram of its latencies (or, for "gate count", of the size
+of every circuit built), and every timed span is kept as a Chrome trace
+event. dump() writes them as JSON stats or as a Chrome trace (open it in
+chrome://tracing or https://ui.perfetto.dev).
+
+Instrumented code brackets a phase with start() and stop():
+    startTime = instrument.start()
+    ...
+    instrument.stop(instrument.BUILD, startTime)
+While disabled, start() returns None and stop() returns right away, so
+the cost is two function calls per phase.
+
+quno.py enables it when the QUNO_STATS or QUNO_TRACE environment
+variable names a file to dump to at the end of the game, e.g.
+    QUNO_TRACE=trace.json python quno.py
+"""
+import json
+import math
+import os
+import threading
+import time
+
+# The phases; "oracle build" is the first build of an oracle and its Grover iterate, "circuit build" everything else
+ORACLE  = "oracle build"
+BUILD   = "circuit build"
+GATES   = "gate count"
+EXECUTE = "backend execute"
+SAMPLE  = "sample"
+DECODE  = "measurement decode"
+RENDER  = "render"
+
+enabled = False
+keepEvents = True
+phases = {}
+events = []
+maxEvents = 200000
+lock = threading.Lock()
+originTime = time.perf_counter()
+
+
+class PhaseStats:
+    """ The count and histogram of one phase
+
+    Latencies go into power-of-two buckets of microseconds: bucket b
+    holds the values in [2^(b-1), 2^b), bucket 0 the values below 1.
+    Gate counts use the same buckets, counting gates instead.
+
+    Attributes
+    ----------------
+    count : int
+        How many values were recorded.
+    total, minimum, maximum : float
+        Their sum, smallest and largest value.
+    buckets : dict
+        Maps a bucket number to the number of values in it.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.minimum = math.inf
+        self.maximum = 0.0
+        self.buckets = {}
+
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        self.minimum = min(self.minimum, value)
+        self.maximum = max(self.maximum, value)
+        bucket = 0 if value < 1 else int(value).bit_length()
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+
+
+    def summary(self):
+        return {
+            "count" : self.count,
+            "total" : self.total,
+            "mean" : self.total / self.count if self.count > 0 else 0.0,
+            "min" : self.minimum if self.count > 0 else 0.0,
+            "max" : self.maximum,
+            "histogram" : {("<1" if bucket == 0 else "<" + str(2**bucket)): self.buckets[bucket]
+                           for bucket in sorted(self.buckets)},
+        }
+
+
+
+# Starts recording, 'trace' also keeps every span for chromeTrace()
+def enable(trace=True):
+    global enabled, keepEvents
+    enabled = True
+    keepEvents = trace
+
+
+def disable():
+    global enabled
+    enabled = False
+
+
+# Forgets everything recorded so far
+def reset():
+    with lock:
+        phases.clear()
+        del events[:]
+
+
+# Returns the start time of a phase, or None while disabled
+def start():
+    if not enabled:
+        return None
+    return time.perf_counter()
+
+
+# Records the phase that started at 'startTime' (from start()) as ending now
+def stop(phase, startTime):
+    if startTime is None:
+        return
+    endTime = time.perf_counter()
+    microseconds = (endTime - startTime) * 1e6
+    with lock:
+        stats = phases.get(phase)
+        if stats is None:
+            stats = phases[phase] = PhaseStats()
+        stats.add(microseconds)
+        if keepEvents and len(events) < maxEvents:
+            events.append({"name": phase, "ph": "X", "ts": (startTime - originTime) * 1e6,
+                           "dur": microseconds, "pid": os.getpid(), "tid": threading.get_ident()})
+
+
+# Records a value that is not a latency, e.g. the gate count of a circuit
+def count(phase, value):
+    if not enabled:
+        return
+    with lock:
+        stats = phases.get(phase)
+        if stats is None:
+            stats = phases[phase] = PhaseStats()
+        stats.add(value)
+        if keepEvents and len(events) < maxEvents:
+            events.append({"name": phase, "ph": "C", "ts": (time.perf_counter() - originTime) * 1e6,
+                           "pid": os.getpid(), "tid": threading.get_ident(), "args": {phase: value}})
+
+
+# The summary of every phase; latencies are in microseconds
+def stats():
+    with lock:
+        return {phase: phases[phase].summary() for phase in sorted(phases)}
+
+
+# Every recorded span in the Chrome trace event format
+def chromeTrace():
+    with lock:
+        return {"traceEvents": list(events), "displayTimeUnit": "ms"}
+
+
+def dump(path, format="json"):
+    """ Writes what was recorded to the file 'path'
+
+    'format' is "json" for the stats of every phase, or "chrome" for a
+    Chrome trace.
+    """
+    assert format in ("json", "chrome"), \
+          "ERROR in instrument.dump() - Unknown format '" + str(format) + "', use 'json' or 'chrome'."
+    with open(path, "w") as outFile:
+        json.dump(stats() if format == "json" else chromeTrace(), outFile, indent=None if format == "chrome" else 2)
+
+
+# One line per phase, for printing
+def summaryLines():
+    lines = []
+    for phase, summary in stats().items():
+        unit = " gates" if phase == GATES else " us"
+        lines.append("{:<20} {:>8} x  mean {:>10.1f}{}  max {:>10.1f}{}".format(
+            phase, summary["count"], summary["mean"], unit, summary["max"], unit))
+    return lines
@@ -12,35 +12,164 @@ class Player:
 
     cards : Card[]
         Represents the hand of cards that the player holds.
+        Only change it through addCard(), removeCard() and revealCard(),
+        which keep the playability index up to date.
+
+    The playability index maps every color and type to the cards of the
+    hand that carry it (both states of a superposition card are indexed),
+    and holds the unmeasured entangled cards, which can always be played.
+    playableIndices() looks up the cards matching the played pile in it,
+    so it only costs as much as the number of matching cards.
+
+    Cards in a hand are never changed in place (revealCard() swaps in a
+    copy), so a forked player shares its hand and index with the original
+    until one of them changes its hand, see fork().
     """
 
-    def __init__(self, turn_number, deck):
+    def __init__(self, turn_number, deck, dealHand=True):
         self.turnNumber = turn_number
         self.cards = []
         self.deck = deck
         self.hasUNO = False
+
+        # The playability index. Dictionaries are used as ordered sets of cards.
+        self.cardsByColor = [{} for _ in range(4)]
+        self.cardsByType = [{} for _ in range(16)]
+        self.entangledCards = {}
+        self.positions = {} # maps each card to its index in self.cards
+        self.indexedCodes = {} # the state codes each card was indexed under
+        self.sharesHand = False # True while the hand is shared with a fork
         
-        self.initialize_hand()
+        if dealHand:
+            self.initialize_hand()
     
 
     # Creates the initial cards
     def initialize_hand(self):
         initialHandSize = 5
         for _ in range(initialHandSize):
-            knownColor, knownType = self.deck.newCard()
-            self.cards.append(card.Card(knownColor, knownType))
+            self.addCard(card.Card.fromCodes(self.deck.newCardCodes()))
+
+
+    # Returns a player with the same hand for a forked game, see GameEngine.fork()
+    def fork(self, deck):
+        forked = Player.__new__(Player)
+        forked.__dict__.update(self.__dict__)
+        forked.deck = deck
+        # whichever of the two changes its hand first copies it
+        forked.sharesHand = True
+        self.sharesHand = True
+        return forked
+
+
+    # Copies the shared hand and index before they are changed
+    def ownHand(self):
+        self.cards = list(self.cards)
+        self.cardsByColor = [cards.copy() for cards in self.cardsByColor]
+        self.cardsByType = [cards.copy() for cards in self.cardsByType]
+        self.entangledCards = self.entangledCards.copy()
+        self.positions = self.positions.copy()
+        self.indexedCodes = self.indexedCodes.copy()
+        self.sharesHand = False
+
+
+    # Replaces the hand with the given cards
+    def setHand(self, cards):
+        self.cards = []
+        self.cardsByColor = [{} for _ in range(4)]
+        self.cardsByType = [{} for _ in range(16)]
+        self.entangledCards = {}
+        self.positions = {}
+        self.indexedCodes = {}
+        self.sharesHand = False
+        for heldCard in cards:
+            self.addCard(heldCard)
+
+
+    # Adds a card to the index
+    def indexCard(self, heldCard):
+        if heldCard.isEntangled:
+            self.entangledCards[heldCard] = None
+            self.indexedCodes[heldCard] = None
+            return
+
+        codes = heldCard.stateCodes()
+        for code in codes:
+            self.cardsByColor[code >> 4][heldCard] = None
+            self.cardsByType[code & 0b1111][heldCard] = None
+        self.indexedCodes[heldCard] = codes
+
+
+    # Removes a card from the index
+    def unindexCard(self, heldCard):
+        codes = self.indexedCodes.pop(heldCard)
+        if codes is None:
+            del self.entangledCards[heldCard]
+            return
+
+        for code in codes:
+            self.cardsByColor[code >> 4].pop(heldCard, None)
+            self.cardsByType[code & 0b1111].pop(heldCard, None)
+
+
+    # Puts a card at the end of the hand
+    def addCard(self, heldCard):
+        if self.sharesHand:
+            self.ownHand()
+        self.positions[heldCard] = len(self.cards)
+        self.cards.append(heldCard)
+        self.indexCard(heldCard)
+
+
+    # Takes a card out of the hand
+    def removeCard(self, heldCard):
+        if self.sharesHand:
+            self.ownHand()
+        self.unindexCard(heldCard)
+        index = self.positions.pop(heldCard)
+        del self.cards[index]
+        for laterCard in self.cards[index:]:
+            self.positions[laterCard] -= 1
+
+
+    # Measures an entangled card of the hand: it is no longer a wildcard. Returns the revealed card.
+    def revealCard(self, heldCard):
+        if self.sharesHand:
+            self.ownHand()
+        index = self.positions.pop(heldCard)
+        self.unindexCard(heldCard)
+
+        revealedCard = heldCard.copy()
+        revealedCard.isEntangled = False
+        self.cards[index] = revealedCard
+        self.positions[revealedCard] = index
+        self.indexCard(revealedCard)
+        return revealedCard
+
+
+    def playableIndices(self, colorTypeTuple):
+        """ Returns the sorted indices of the cards that can be played on colorTypeTuple
+
+        Gives the same cards as Card.isPlayable(), see Player for the index.
+        """
+        if colorTypeTuple is None:
+            return list(range(len(self.cards)))
+
+        topColor, topType = colorTypeTuple
+        matches = self.cardsByColor[topColor.value].keys() | self.cardsByType[topType.value].keys() \
+                  | self.entangledCards.keys()
+        return sorted(self.positions[heldCard] for heldCard in matches)
     
 
     # Prints out the cards
     def __str__(self):
-        print("--------------------------------------------------------------------------")
-        print("██    ██  ██████  ██    ██ ██████      ██   ██  █████  ███    ██ ██████  ")
-        print(" ██  ██  ██    ██ ██    ██ ██   ██     ██   ██ ██   ██ ████   ██ ██   ██ ")
-        print("  ████   ██    ██ ██    ██ ██████      ███████ ███████ ██ ██  ██ ██   ██ ")
-        print("   ██    ██    ██ ██    ██ ██   ██     ██   ██ ██   ██ ██  ██ ██ ██   ██ ")
-        print("   ██     ██████   ██████  ██   ██     ██   ██ ██   ██ ██   ████ ██████  ")
-        print("--------------------------------------------------------------------------")
-        returnString = ""
+        returnString = "--------------------------------------------------------------------------\n" \
+            + "██    ██  ██████  ██    ██ ██████      ██   ██  █████  ███    ██ ██████  \n" \
+            + " ██  ██  ██    ██ ██    ██ ██   ██     ██   ██ ██   ██ ████   ██ ██   ██ \n" \
+            + "  ████   ██    ██ ██    ██ ██████      ███████ ███████ ██ ██  ██ ██   ██ \n" \
+            + "   ██    ██    ██ ██    ██ ██   ██     ██   ██ ██   ██ ██  ██ ██ ██   ██ \n" \
+            + "   ██     ██████   ██████  ██   ██     ██   ██ ██   ██ ██   ████ ██████  \n" \
+            + "--------------------------------------------------------------------------\n"
         for i in range(len(self.cards)):
             returnString += "Card #" + str(i) + ":\n" + str(self.cards[i]) + "\n"
         
@@ -1,192 +1,274 @@
 import os
-import sys
-import player
-import deck
+
+import ai
+import card
+import engine
+import instrument
+import render
+import speculation
 
 # Main Game Logic
 
-class Game:
+class Game(engine.GameEngine):
     """ Manages the current state of the game
 
-    This handles the main interface between the users and this program.
-    The text UI, primary game loop and win condition checks are all
-    here.
-    """
+    This handles the main interface between the users and this program:
+    the text UI and the primary game loop. The rules themselves (turns,
+    card actions and win condition checks) live in engine.GameEngine,
+    so this class only turns console input into engine actions and
+    prints the table.
 
-    def __init__(self, numPlayers):
-        self.playerIndex = 0
-        self.players = []
-        self.topOfPlayedPile = None
+    The game loop in start_game() is a flat loop over play_turn(), so a
+    game of any length runs with a constant stack depth. Once a player
+    wins, winner holds their index and start_game() returns.
 
-        self.deck = deck.Deck()
-        
-        self.initialize_players(numPlayers)
-    
-    
-    # Creates the player objects
-    def initialize_players(self, numPlayers):
-        for i in range(numPlayers):
-            self.players.append(player.Player(i+1, self.deck))
+    computerPlayers maps a player index to a computer player from ai.py
+    (anything with a chooseAction(game) method), which takes that
+    player's turns instead of the console.
 
+    With speculate, every card of a human player's hand and the top of
+    the deck are measured in the background while they choose their move,
+    see speculation.Speculator.
 
-    # Handles the game input
+    While instrument.py is enabled, typing "stats" at the card prompt
+    prints the time spent in every phase so far.
+    """
+
+    def __init__(self, numPlayers, backend=None, log=None, computerPlayers=None, speculate=True):
+        super().__init__(numPlayers, backend, log=log)
+        self.computerPlayers = computerPlayers if computerPlayers is not None else {}
+        self.speculator = speculation.Speculator() if speculate else None
+        self.renderer = render.Renderer()
+
+
+    # Handles the game input, returns the chosen engine action
     def validPlayInput(self, currentPlayer, outString): 
         givenInput = ""
+        attempts = 0
         while True:
+            # retries print below the screen, which the renderer can not keep track of
+            attempts += 1
+            if attempts > 1:
+                self.renderer.forget()
             givenInput = input(outString)
             if givenInput.isnumeric() and 0 <= int(givenInput) < len(currentPlayer.cards):
                 cardSelectionIndex = int(givenInput)
-                playedCard = currentPlayer.cards[cardSelectionIndex]
-                if playedCard.isPlayable(self.topOfPlayedPile): 
-                    if playedCard.isEntangled == True:
-                        playedCard.isEntangled = False
-                        return (True, None)
-                    else:
-                        return (False, playedCard)
+                if cardSelectionIndex in self.legal_actions(): 
+                    return cardSelectionIndex
                 else:
                     outString = "   Sorry! That card can not be played because the color/type does not match."
                     continue
             elif givenInput.lower() == "d" or givenInput.lower() == "deck":
-                # self.deck.addRYPhase()
-                playedCard = self.deck.getTopCard()
-                return (True, playedCard)
+                return engine.GameEngine.DRAW
+            elif givenInput.lower() == "stats" and instrument.enabled:
+                print("\n".join(instrument.summaryLines()))
+                continue
             outString = "   Please enter in a valid card id number to play a card from your hand,\n" \
                 + "    or enter \"deck\"/\"d\" to retrieve the top deck card."
 
     
-    # Prints out the general user interface here
-    def displayTurnUI(self):
-        print("----------------------------------------")
-        print("██████  ███████  ██████ ██   ██ ")
-        print("██   ██ ██      ██      ██  ██  ")
-        print("██   ██ █████   ██      █████   ")
-        print("██   ██ ██      ██      ██  ██  ")
-        print("██████  ███████  ██████ ██   ██ ")
-        print("----------------------------------------")
-        print("The next card from the deck will be: ")
+    # The lines of the deck preview
+    def deckLines(self):
+        lines = [
+            "----------------------------------------",
+            "██████  ███████  ██████ ██   ██ ",
+            "██   ██ ██      ██      ██  ██  ",
+            "██   ██ █████   ██      █████   ",
+            "██   ██ ██      ██      ██  ██  ",
+            "██████  ███████  ██████ ██   ██ ",
+            "----------------------------------------",
+            "The next card from the deck will be: ",
+        ]
         if len(self.deck.deckColors) == 2:
-            print("    A superposition of:")
-            print("    " + str(self.deck.topOfDeckColor[0][0]) + " and " + str(self.deck.topOfDeckColor[0][1]))
+            lines.append("    A superposition of:")
+            lines.append("    " + str(self.deck.topOfDeckColor[0][0]) + " and " + str(self.deck.topOfDeckColor[0][1]))
             if len(self.deck.topOfDeckColor) == 2:
-                print("         OR")
-                print("    " + str(self.deck.topOfDeckColor[1][0]) + " and " + str(self.deck.topOfDeckColor[1][1]))
+                lines.append("         OR")
+                lines.append("    " + str(self.deck.topOfDeckColor[1][0]) + " and " + str(self.deck.topOfDeckColor[1][1]))
         else:
-            print("    " + str(self.deck.topOfDeckColor[0][0]))
+            lines.append("    " + str(self.deck.topOfDeckColor[0][0]))
             if len(self.deck.topOfDeckColor) == 2:
-                print("         OR")
-                print("    " + str(self.deck.topOfDeckColor[1][0]))
-        print("    Current Phase: " + str(self.deck.ryGateCount) + " * pi/2\n")
-
-        print("------------------------------------------------------------------")
-        print("██    ██ ███████ ███████ ██████      ██████  ██ ██      ███████ ")
-        print("██    ██ ██      ██      ██   ██     ██   ██ ██ ██      ██      ")
-        print("██    ██ ███████ █████   ██   ██     ██████  ██ ██      █████   ")
-        print("██    ██      ██ ██      ██   ██     ██      ██ ██      ██      ")
-        print(" ██████  ███████ ███████ ██████      ██      ██ ███████ ███████ ")
-        print("------------------------------------------------------------------")
+                lines.append("         OR")
+                lines.append("    " + str(self.deck.topOfDeckColor[1][0]))
+        lines.append("    Current Phase: " + str(self.deck.ryGateCount) + " * pi/2")
+        lines.append("")
+        return lines
+
 
+    # The lines of the used pile
+    def pileLines(self):
+        lines = [
+            "------------------------------------------------------------------",
+            "██    ██ ███████ ███████ ██████      ██████  ██ ██      ███████ ",
+            "██    ██ ██      ██      ██   ██     ██   ██ ██ ██      ██      ",
+            "██    ██ ███████ █████   ██   ██     ██████  ██ ██      █████   ",
+            "██    ██      ██ ██      ██   ██     ██      ██ ██      ██      ",
+            " ██████  ███████ ███████ ██████      ██      ██ ███████ ███████ ",
+            "------------------------------------------------------------------",
+        ]
         if self.topOfPlayedPile is not None:
-            print("Last played card: " + str(self.topOfPlayedPile[0]) + " : " + str(self.topOfPlayedPile[1]) + "\n")
+            lines.append("Last played card: " + str(self.topOfPlayedPile[0]) + " : " + str(self.topOfPlayedPile[1]))
         else:
-            print("No cards have been played yet. You can place down any card that you want.\n")
+            lines.append("No cards have been played yet. You can place down any card that you want.")
+        lines.append("")
+        return lines
 
+
+    # The lines of the UNO warnings, as seen by the player at viewerIndex
+    def unoLines(self, viewerIndex):
         # check for players that have UNO
         playersWithUNO = []
         for player in self.players:
             if player.hasUNO == True:
                 playersWithUNO.append(player.turnNumber)
-        if len(playersWithUNO) > 0 and (self.playerIndex+1) not in playersWithUNO:
-            print("------------------------------------------------------------")
-            print("██     ██  █████  ██████  ███    ██ ██ ███    ██  ██████  ")
-            print("██     ██ ██   ██ ██   ██ ████   ██ ██ ████   ██ ██       ")
-            print("██  █  ██ ███████ ██████  ██ ██  ██ ██ ██ ██  ██ ██   ███ ")
-            print("██ ███ ██ ██   ██ ██   ██ ██  ██ ██ ██ ██  ██ ██ ██    ██ ")
-            print(" ███ ███  ██   ██ ██   ██ ██   ████ ██ ██   ████  ██████  ")
-            print("------------------------------------------------------------")
-            print("The following players currently have QUNO has are about to win")
+
+        lines = []
+        if len(playersWithUNO) > 0 and (viewerIndex+1) not in playersWithUNO:
+            lines += [
+                "------------------------------------------------------------",
+                "██     ██  █████  ██████  ███    ██ ██ ███    ██  ██████  ",
+                "██     ██ ██   ██ ██   ██ ████   ██ ██ ████   ██ ██       ",
+                "██  █  ██ ███████ ██████  ██ ██  ██ ██ ██ ██  ██ ██   ███ ",
+                "██ ███ ██ ██   ██ ██   ██ ██  ██ ██ ██ ██  ██ ██ ██    ██ ",
+                " ███ ███  ██   ██ ██   ██ ██   ████ ██ ██   ████  ██████  ",
+                "------------------------------------------------------------",
+                "The following players currently have QUNO has are about to win",
+            ]
             for num in playersWithUNO:
-                print("    Player " + str(num))
-            print()
-
-        elif (self.playerIndex+1) in playersWithUNO:
-            print("---------------------------------------")
-            print(" ██████  ██    ██ ███    ██  ██████  ")
-            print("██    ██ ██    ██ ████   ██ ██    ██ ")
-            print("██    ██ ██    ██ ██ ██  ██ ██    ██ ")
-            print("██ ▄▄ ██ ██    ██ ██  ██ ██ ██    ██ ")
-            print(" ██████   ██████  ██   ████  ██████  ")
-            print("    ▀▀                               ")
-            print("---------------------------------------")
-            print("You currently have QUNO! You're almost there!\n")
-
-
-    # Handles the main game logic for turns
+                lines.append("    Player " + str(num))
+            lines.append("")
+
+        elif (viewerIndex+1) in playersWithUNO:
+            lines += [
+                "---------------------------------------",
+                " ██████  ██    ██ ███    ██  ██████  ",
+                "██    ██ ██    ██ ████   ██ ██    ██ ",
+                "██    ██ ██    ██ ██ ██  ██ ██    ██ ",
+                "██ ▄▄ ██ ██    ██ ██  ██ ██ ██    ██ ",
+                " ██████   ██████  ██   ████  ██████  ",
+                "    ▀▀                               ",
+                "---------------------------------------",
+                "You currently have QUNO! You're almost there!",
+                "",
+            ]
+        return lines
+
+
+    # The lines of the general user interface, as seen by the player at viewerIndex (default: current player)
+    def turnLines(self, viewerIndex=None):
+        if viewerIndex is None:
+            viewerIndex = self.playerIndex
+        return self.deckLines() + self.pileLines() + self.unoLines(viewerIndex)
+
+
+    # Prints out the general user interface here, as seen by the player at viewerIndex (default: current player)
+    def displayTurnUI(self, viewerIndex=None):
+        print("\n".join(self.turnLines(viewerIndex)))
+
+
+    # The whole screen of a turn: the table and the hand of the player at viewerIndex
+    def turnScreen(self, viewerIndex):
+        return ["Welcome Player " + str(viewerIndex + 1) + "."] + self.turnLines(viewerIndex) \
+            + str(self.players[viewerIndex]).splitlines()
+
+
+    # Handles the main game logic for turns, returns True once the game is over
     def play_turn(self):
+        if self.playerIndex in self.computerPlayers:
+            return self.play_computer_turn()
+
         # Display starting UI
-        clear_console()
-        print("Welcome Player " + str(self.playerIndex + 1) + ".")
-        self.displayTurnUI()
-        currentPlayer = self.players[self.playerIndex]
-        print(currentPlayer)
+        currentPlayer = self.currentPlayer()
+        self.renderer.draw(self.turnScreen(self.playerIndex))
+
+        # Measure the possible moves while the player decides
+        if self.speculator is not None:
+            self.speculator.start(self)
 
         # Receive input
-        pulledDeck, playedCard = self.validPlayInput(currentPlayer, "Select a Card from 0 to " + str(len(currentPlayer.cards) - 1) \
+        action = self.validPlayInput(currentPlayer, "Select a Card from 0 to " + str(len(currentPlayer.cards) - 1) \
             + ", or type \"d\" to draw the from the deck.")
-        
-        nextPlayerIndex = (self.playerIndex + 1) % len(self.players)
-        if pulledDeck is False: 
-            # Collapse superposition (if there was one)
-            self.topOfPlayedPile = playedCard.measure()
-            currentPlayer.cards.remove(playedCard)
-
-            # Do the card's action
-            actionReturn = playedCard.action(self.players[nextPlayerIndex], self)
-            if actionReturn is not None:
-                self.topOfPlayedPile = actionReturn
-        elif playedCard is not None:
-            self.players[self.playerIndex].cards.append(playedCard)
-
-        # Check win/UNO condition
-        if len(currentPlayer.cards) == 0:
+
+        measured = self.speculator.take(self, action) if self.speculator is not None else None
+        if measured is None and action != engine.GameEngine.DRAW and not currentPlayer.cards[action].isEntangled \
+                and self.session.backend == card.Backend.AER:
+            print("   Please wait, our Grover monkeys are doing a lot of quantum magic...")
+
+        playerIndex = self.playerIndex
+        result = self.step(action, measured)
+
+        # Check win condition
+        if result.isOver:
             self.win()
-        elif len(currentPlayer.cards) == 1:
-            currentPlayer.hasUNO = True
-        else:
-            currentPlayer.hasUNO = False
+            return True
         
-        # redisplay the table
-        clear_console()
-        self.displayTurnUI()
-        print(currentPlayer)
+        # redisplay the table, only the changed lines are redrawn
+        self.renderer.draw(self.turnScreen(playerIndex))
         input("Press enter...")
 
-        self.playerIndex = nextPlayerIndex
-        self.next_turn()
+        return False
+
+
+    # Lets the computer player take the current turn, returns True once the game is over
+    def play_computer_turn(self):
+        # the lines printed here are not part of any screen
+        self.renderer.forget()
+        print("Player " + str(self.playerIndex + 1) + " (computer) is thinking...")
+        action = self.computerPlayers[self.playerIndex].chooseAction(self)
+
+        playerNumber = self.playerIndex + 1
+        result = self.step(action)
+        if result.drawnCard is not None:
+            print("Player " + str(playerNumber) + " drew a card from the deck.")
+        elif result.measuredResult is None:
+            print("Player " + str(playerNumber) + " measured an entangled card.")
+        else:
+            print("Player " + str(playerNumber) + " played " + str(self.topOfPlayedPile[0]) + " : " \
+                + str(self.topOfPlayedPile[1]) + ".")
+
+        if result.isOver:
+            self.win()
+            return True
+        return False
 
 
     def next_turn(self):
+        # computer players do not need the screen
+        if self.playerIndex in self.computerPlayers:
+            return
         # clear_console()
         input("Please bring player " + str(self.playerIndex + 1) + " to the computer! Press enter once you do. :)")
         # clear_console()
-        self.play_turn()
 
     def win(self):
         print("CONGRATULATIONS! YOU WON, PLAYER " + str(self.playerIndex + 1) + "!")
-        sys.exit()
 
+    # Runs turns until a player wins, returns the index of the winner
     def start_game(self):
-        self.play_turn()
+        try:
+            while not self.play_turn():
+                self.next_turn()
+        finally:
+            # also when the game is quit or crashes, so the log file is complete
+            if self.log is not None:
+                self.log.close()
+        if self.speculator is not None:
+            self.speculator.shutdown()
+        dumpInstrumentation()
+        return self.winner
+
+
+# Writes the instrumentation to the files named by QUNO_STATS (JSON stats) and QUNO_TRACE (Chrome trace)
+def dumpInstrumentation():
+    if os.environ.get("QUNO_STATS"):
+        instrument.dump(os.environ["QUNO_STATS"], "json")
+    if os.environ.get("QUNO_TRACE"):
+        instrument.dump(os.environ["QUNO_TRACE"], "chrome")
 
 
 # Empties the console window
 def clear_console():
-    if os.name=='nt':
-        os.system("cls")   # Windows
-    else:
-        os.system("clear") # Linux/Mac
-
-    for _ in range(100):
-        print("\n")
+    render.Renderer().clear()
 
 
 # Checks for input on the number of players
@@ -207,6 +289,8 @@ def validNumInput(outString, lowerLimit, upperLimit):
 
 # Starting point of the program
 if __name__ == "__main__":
+    if os.environ.get("QUNO_STATS") or os.environ.get("QUNO_TRACE"):
+        instrument.enable(trace=bool(os.environ.get("QUNO_TRACE")))
     clear_console()
     print("--------------------------------------------------------------------------------")
     print("|                                                                              |")
@@ -222,10 +306,15 @@ if __name__ == "__main__":
     print("     Developed by Abdullah Assaf, Emily Padilla, and Richard Noh")
     print("")
     playerTotal = validNumInput("To start the game, please enter in the number of players for this game of QUNO:  ", 2, 9)
+    computerTotal = validNumInput("How many of them are computer players? ", 0, int(playerTotal))
     print("Before the game starts, please decide amongst yourselves who will be player\n1, 2, and etc.")
+    if int(computerTotal) > 0:
+        print("The computer players are the last " + str(computerTotal) + " players.")
     input("Once you have decided, please press Enter:")
 
     clear_console()
 
-    game = Game(int(playerTotal))
+    # the computer players take the last seats
+    computerPlayers = {i: ai.ISMCTSPlayer() for i in range(int(playerTotal) - int(computerTotal), int(playerTotal))}
+    game = Game(int(playerTotal), computerPlayers=computerPlayers)
     game.start_game()
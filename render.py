@@ -0,0 +1,105 @@
+""" Draws the console screens of QUNO
+
+Instead of clearing the terminal with a shell command and printing a
+screen line by line, a Renderer composes the whole screen as a list of
+lines and sends it to the terminal in a single write, using ANSI escape
+codes to move the cursor. It remembers the last screen, so redrawing
+only rewrites the lines that changed: the banners stay where they are
+and only the deck preview, the used pile and the hand are updated.
+
+Windows consoles may not understand ANSI escape codes, so there the
+screen is cleared with "cls" and always written in full.
+"""
+import os
+import shutil
+import sys
+import instrument
+
+# Also clears the scrollback, so the hand of the previous player can not be scrolled back to
+CLEAR_SCREEN = "\x1b[H\x1b[2J\x1b[3J"
+CLEAR_LINE_END = "\x1b[K"
+CLEAR_SCREEN_END = "\x1b[J"
+
+
+# Moves the cursor to the start of 'row' (0 is the top row)
+def moveTo(row):
+    return "\x1b[" + str(row + 1) + ";1H"
+
+
+class Renderer:
+    """ Writes screens to a terminal, redrawing only what changed
+
+    The diff relies on every line staying on the row it was drawn on, so
+    a screen (plus 'margin' rows for the prompts printed below it) must
+    fit in the terminal. Taller screens, and the first screen after
+    clear(), are written in full, still in a single write. Anything printed
+    below a screen beyond those 'margin' rows scrolls the terminal, so
+    whoever prints it must call forget() afterwards.
+
+    Attributes
+    ----------------
+    stream : file
+        Where the screens are written, sys.stdout by default.
+    useAnsi : bool
+        Whether the terminal understands ANSI escape codes (not on Windows by
+        default). Without them, clear() runs "cls" and every screen is drawn
+        in full.
+    lines : str[]
+        The lines of the last screen, or None if the terminal content is unknown.
+    writes, bytesWritten : int
+        How many writes were made and how much they wrote.
+    """
+
+    def __init__(self, stream=None, margin=4, useAnsi=None):
+        self.stream = stream
+        self.margin = margin
+        self.useAnsi = useAnsi if useAnsi is not None else os.name != 'nt'
+        self.lines = None
+        self.writes = 0
+        self.bytesWritten = 0
+
+
+    def write(self, text):
+        stream = self.stream if self.stream is not None else sys.stdout
+        stream.write(text)
+        stream.flush()
+        self.writes += 1
+        self.bytesWritten += len(text)
+
+
+    # Empties the terminal
+    def clear(self):
+        if self.useAnsi:
+            self.write(CLEAR_SCREEN)
+        else:
+            os.system("cls") # Windows
+        self.lines = None
+
+
+    # Marks the terminal content as unknown, so the next screen is drawn in full
+    def forget(self):
+        self.lines = None
+
+
+    def draw(self, lines):
+        """ Shows the screen made of 'lines' and leaves the cursor below it
+
+        Anything printed below the last screen (e.g. prompts and their
+        answers) is erased.
+        """
+        startTime = instrument.start()
+        rows = shutil.get_terminal_size().lines
+        if not self.useAnsi:
+            self.clear()
+            self.write("\n".join(lines) + "\n")
+        elif self.lines is None or len(lines) + self.margin > rows:
+            self.write(CLEAR_SCREEN + "\n".join(lines) + "\n")
+        else:
+            parts = []
+            for row, line in enumerate(lines):
+                if row >= len(self.lines) or self.lines[row] != line:
+                    parts.append(moveTo(row) + line + CLEAR_LINE_END)
+            parts.append(moveTo(len(lines)) + CLEAR_SCREEN_END)
+            self.write("".join(parts))
+        self.lines = list(lines)
+        instrument.stop(instrument.RENDER, startTime)
@@ -0,0 +1,160 @@
+""" Runs many complete games of QUNO between computer players
+
+Games run in parallel on a process pool. Every game gets its own seed,
+so each worker builds its own seeded Deck and QuantumSession. The
+statistics of each game stream back to the parent as soon as it
+finishes, and the parent reports the throughput at the end.
+
+Example:
+    python selfplay.py --games 1000 --players 4 --workers 8 --backend analytic
+"""
+import argparse
+import time
+import concurrent.futures
+import numpy as np
+
+import ai
+import card
+import engine
+
+PLAYER_TYPES = {
+    "random" : ai.RandomPlayer,
+    "greedy" : ai.GreedyPlayer,
+    "ismcts" : ai.ISMCTSPlayer,
+}
+
+# The latency phases timed for every game
+PHASES = ("setup", "decide", "play", "draw")
+
+
+def playGame(gameNumber, seed, numPlayers, backend, playerType, maxTurns):
+    """ Plays one game to the end and returns its statistics
+
+    Runs inside a worker process, so everything in the returned
+    dictionary must be picklable.
+    """
+    phaseSeconds = dict.fromkeys(PHASES, 0.0)
+    phaseCounts = dict.fromkeys(PHASES, 0)
+
+    start = time.perf_counter()
+    game = engine.GameEngine(numPlayers, backend, seed=seed)
+    players = [PLAYER_TYPES[playerType](seed=seed + i) for i in range(numPlayers)]
+    phaseSeconds["setup"] += time.perf_counter() - start
+    phaseCounts["setup"] += 1
+
+    stats = {
+        "game" : gameNumber,
+        "seed" : seed,
+        "winner" : None,
+        "turns" : 0,
+        "cardsDrawn" : 0,
+        "entangledMade" : 0,
+        "entangledMeasured" : 0,
+        "superpositionsPlayed" : 0,
+        "addPhasesPlayed" : 0,
+    }
+
+    while not game.isOver() and game.turnCount < maxTurns:
+        start = time.perf_counter()
+        action = players[game.playerIndex].chooseAction(game)
+        phaseSeconds["decide"] += time.perf_counter() - start
+        phaseCounts["decide"] += 1
+
+        phase = "draw" if action == engine.GameEngine.DRAW else "play"
+        start = time.perf_counter()
+        result = game.step(action)
+        phaseSeconds[phase] += time.perf_counter() - start
+        phaseCounts[phase] += 1
+
+        if result.drawnCard is not None:
+            stats["cardsDrawn"] += 1
+        if result.entangledCard is not None:
+            stats["entangledMade"] += 1
+        if result.playedCard is not None and result.measuredResult is None:
+            stats["entangledMeasured"] += 1
+        if result.wasSuperposition:
+            stats["superpositionsPlayed"] += 1
+        if result.measuredResult is not None and result.measuredResult[1] == card.Type.ADD_PHASE:
+            stats["addPhasesPlayed"] += 1
+
+    stats["winner"] = game.winner
+    stats["turns"] = game.turnCount
+    stats["phaseSeconds"] = phaseSeconds
+    stats["phaseCounts"] = phaseCounts
+    return stats
+
+
+def runSelfPlay(games, numPlayers=4, workers=None, backend=card.Backend.ANALYTIC,
+                playerType="random", seed=None, maxTurns=10000, onResult=None):
+    """ Plays 'games' games on a process pool of 'workers' processes
+
+    onResult(stats) is called in the parent for every game as soon as it
+    finishes. Returns a summary dictionary with the throughput and the mean
+    latency of every phase.
+    """
+    seeds = np.random.SeedSequence(seed).generate_state(games)
+    totals = dict.fromkeys(PHASES, 0.0)
+    counts = dict.fromkeys(PHASES, 0)
+    turns = 0
+    wins = [0] * numPlayers
+    unfinished = 0
+
+    start = time.perf_counter()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(playGame, i, int(seeds[i]), numPlayers, backend, playerType, maxTurns)
+                   for i in range(games)]
+        for future in concurrent.futures.as_completed(futures):
+            stats = future.result()
+            turns += stats["turns"]
+            if stats["winner"] is None:
+                unfinished += 1
+            else:
+                wins[stats["winner"]] += 1
+            for phase in PHASES:
+                totals[phase] += stats["phaseSeconds"][phase]
+                counts[phase] += stats["phaseCounts"][phase]
+            if onResult is not None:
+                onResult(stats)
+    elapsed = time.perf_counter() - start
+
+    return {
+        "games" : games,
+        "seconds" : elapsed,
+        "gamesPerSecond" : games / elapsed,
+        "turnsPerSecond" : turns / elapsed,
+        "wins" : wins,
+        "unfinished" : unfinished,
+        "meanPhaseSeconds" : {phase: totals[phase] / counts[phase] if counts[phase] > 0 else 0.0
+                              for phase in PHASES},
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runs QUNO games between computer players.")
+    parser.add_argument("--games", type=int, default=100)
+    parser.add_argument("--players", type=int, default=4, choices=range(2, 9))
+    parser.add_argument("--workers", type=int, default=None, help="defaults to the number of CPUs")
+    parser.add_argument("--backend", default="analytic", choices=[b.name.lower() for b in card.Backend])
+    parser.add_argument("--player-type", default="random", choices=list(PLAYER_TYPES))
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--max-turns", type=int, default=10000)
+    parser.add_argument("--quiet", action="store_true", help="only print the final report")
+    args = parser.parse_args()
+
+    def printResult(stats):
+        if not args.quiet:
+            print("game {:>6}  winner {:>4}  turns {:>5}  drawn {:>4}  entangled {:>3}  superpositions {:>3}  addphase {:>3}".format(
+                stats["game"], "-" if stats["winner"] is None else stats["winner"] + 1, stats["turns"],
+                stats["cardsDrawn"], stats["entangledMade"], stats["superpositionsPlayed"], stats["addPhasesPlayed"]))
+
+    summary = runSelfPlay(args.games, args.players, args.workers, card.Backend[args.backend.upper()],
+                          args.player_type, args.seed, args.max_turns, printResult)
+
+    print("----------------------------------------")
+    print("Played {} games in {:.2f} s".format(summary["games"], summary["seconds"]))
+    print("    {:.1f} games/s, {:.0f} turns/s".format(summary["gamesPerSecond"], summary["turnsPerSecond"]))
+    print("    wins per player: " + ", ".join(str(w) for w in summary["wins"])
+          + ("  ({} unfinished)".format(summary["unfinished"]) if summary["unfinished"] > 0 else ""))
+    print("Mean latency per phase:")
+    for phase, seconds in summary["meanPhaseSeconds"].items():
+        print("    {:<8} {:>10.1f} us".format(phase, seconds * 1e6))
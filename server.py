@@ -0,0 +1,373 @@
+""" Hosts many concurrent QUNO tables over TCP
+
+Every client speaks JSON lines: one JSON object per line in each direction.
+A client creates or joins a table and is given a seat; whenever a turn is
+played at the table, every seated client receives the new state of the
+table as seen from their seat.
+
+Requests (the "id" field of a request, if present, is copied into its reply):
+    {"cmd": "create", "players": 4, "backend": "analytic"}   creates a table, replies {"table": id}
+    {"cmd": "join", "table": id}                             takes the next free seat, replies {"seat": i, "state": ...}
+    {"cmd": "state"}                                         replies {"state": ...} for the client's seat
+    {"cmd": "play", "action": 2}                             plays card #2 of the hand ("draw" draws a card)
+    {"cmd": "tables"}                                        lists the open tables
+    {"cmd": "metrics"}                                       per-table and global latency metrics
+
+Turns run engine.GameEngine.step(), whose measurements (Card.measure(),
+Deck.getTopCard() and Deck.newEntangled()) block until the simulator is
+done. They run on a thread pool, so a slow Aer job only holds up its own
+table. A table plays one turn at a time.
+
+A table is removed as soon as its game is over and nobody is seated at
+it, and once nobody has been seated at it for 'idleSeconds'.
+
+Example:
+    python server.py --port 8765 --workers 8
+    nc localhost 8765
+    {"cmd": "create", "players": 2}
+"""
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import json
+import time
+import numpy as np
+
+import card
+import engine
+
+
+class LatencyStats:
+    """ Counts events and keeps their recent latencies
+
+    Attributes
+    ----------------
+    count : int
+        The number of recorded events.
+    totalSeconds, maxSeconds : float
+        The total and the largest latency of every recorded event.
+    recent : deque
+        The latencies of the last 'window' events, for the percentiles.
+    """
+
+    def __init__(self, window=1024):
+        self.count = 0
+        self.totalSeconds = 0.0
+        self.maxSeconds = 0.0
+        self.recent = collections.deque(maxlen=window)
+
+
+    def record(self, seconds):
+        self.count += 1
+        self.totalSeconds += seconds
+        self.maxSeconds = max(self.maxSeconds, seconds)
+        self.recent.append(seconds)
+
+
+    # Summary in milliseconds
+    def summary(self):
+        if self.count == 0:
+            return {"count": 0}
+        p50, p95, p99 = np.percentile(self.recent, [50, 95, 99])
+        return {
+            "count" : self.count,
+            "meanMs" : 1000 * self.totalSeconds / self.count,
+            "p50Ms" : 1000 * p50,
+            "p95Ms" : 1000 * p95,
+            "p99Ms" : 1000 * p99,
+            "maxMs" : 1000 * self.maxSeconds,
+        }
+
+
+
+# What a player may see of a card: nothing but the flag for an unmeasured entangled card, see Card.__str__()
+def cardView(heldCard):
+    if heldCard.isEntangled:
+        return {"entangled" : True}
+    return {
+        "colors" : [str(color) for color in heldCard.knownColor],
+        "types" : [str(cardType) for cardType in heldCard.knownType],
+        "entangled" : False,
+    }
+
+
+
+class Table:
+    """ One game of QUNO hosted by the server
+
+    Attributes
+    ----------------
+    tableId : int
+        The id clients use to join the table.
+    game : engine.GameEngine
+        The game played at the table.
+    seats : list
+        The client connection of every seat, or None while it is free.
+    lock : asyncio.Lock
+        Held while a turn is played, so turns of the table never overlap.
+    turnLatency : LatencyStats
+        How long every turn took, including the wait for the thread pool.
+    lastActive : float
+        The time.perf_counter() of the last join, turn or leave.
+    """
+
+    def __init__(self, tableId, numPlayers, backend):
+        self.tableId = tableId
+        self.game = engine.GameEngine(numPlayers, backend)
+        self.seats = [None] * numPlayers
+        self.lock = asyncio.Lock()
+        self.turnLatency = LatencyStats()
+        self.lastActive = time.perf_counter()
+
+
+    # Returns the first free seat, or None if the table is full
+    def freeSeat(self):
+        for i, connection in enumerate(self.seats):
+            if connection is None:
+                return i
+        return None
+
+
+    def isEmpty(self):
+        return all(connection is None for connection in self.seats)
+
+
+    # The state of the table as seen by the player at 'seat'
+    def view(self, seat):
+        game = self.game
+        deck = game.deck
+        isTurn = not game.isOver() and seat == game.playerIndex
+        return {
+            "table" : self.tableId,
+            "seat" : seat,
+            "currentPlayer" : game.playerIndex,
+            "turn" : game.turnCount,
+            "winner" : game.winner,
+            "topOfPlayedPile" : None if game.topOfPlayedPile is None else
+                                [str(game.topOfPlayedPile[0]), str(game.topOfPlayedPile[1])],
+            "deck" : {
+                "colors" : [[str(color) for color in colors if color is not None] for colors in deck.topOfDeckColor],
+                "phase" : deck.ryGateCount,
+            },
+            "handSizes" : [len(p.cards) for p in game.players],
+            "hasUNO" : [p.hasUNO for p in game.players],
+            "hand" : [cardView(heldCard) for heldCard in game.players[seat].cards],
+            "legalActions" : [("draw" if action == engine.GameEngine.DRAW else action)
+                              for action in game.legal_actions()] if isTurn else [],
+        }
+
+
+
+class Connection:
+    """ A connected client and the seat it holds """
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.table = None
+        self.seat = None
+
+
+    def send(self, message):
+        self.writer.write((json.dumps(message) + "\n").encode())
+
+
+
+class QunoServer:
+    """ Hosts the tables and serves the clients
+
+    Every turn is played on 'executor' (a thread pool of 'workers'
+    threads by default). The metrics are the latency of every turn
+    per table and over all tables, and the latency of every request.
+    Tables nobody is seated at are removed once their game is over or
+    after 'idleSeconds' without a player.
+    """
+
+    def __init__(self, workers=None, executor=None, idleSeconds=600.0):
+        self.executor = executor if executor is not None \
+                        else concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+        self.tables = {}
+        self.nextTableId = 0
+        self.idleSeconds = idleSeconds
+        self.removedTables = 0
+        self.turnLatency = LatencyStats()
+        self.requestLatency = LatencyStats()
+        self.startTime = time.perf_counter()
+
+
+    async def serve(self, host, port):
+        server = await asyncio.start_server(self.handleClient, host, port)
+        sweeper = asyncio.ensure_future(self.sweepTables())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            sweeper.cancel()
+
+
+    # Removes the idle tables every so often, also those nobody ever joined
+    async def sweepTables(self):
+        while True:
+            await asyncio.sleep(min(60.0, self.idleSeconds))
+            for table in list(self.tables.values()):
+                self.removeIfDone(table)
+
+
+    # Removes 'table' if nobody is seated and its game is over or it has been idle for too long
+    def removeIfDone(self, table):
+        if not table.isEmpty() or table.lock.locked():
+            return
+        if table.game.isOver() or time.perf_counter() - table.lastActive >= self.idleSeconds:
+            if self.tables.pop(table.tableId, None) is not None:
+                self.removedTables += 1
+
+
+    async def handleClient(self, reader, writer):
+        connection = Connection(reader, writer)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+
+                start = time.perf_counter()
+                try:
+                    request = json.loads(line)
+                    if not isinstance(request, dict):
+                        raise TypeError("a request must be a JSON object")
+                    reply = await self.handleRequest(connection, request)
+                except (ValueError, KeyError, TypeError, AttributeError) as error:
+                    request, reply = {}, {"error": str(error)}
+                if isinstance(request, dict) and "id" in request:
+                    reply["id"] = request["id"]
+                connection.send(reply)
+                await writer.drain()
+                self.requestLatency.record(time.perf_counter() - start)
+        except ConnectionError:
+            pass
+        finally:
+            if connection.table is not None:
+                table = connection.table
+                table.seats[connection.seat] = None
+                table.lastActive = time.perf_counter()
+                self.removeIfDone(table)
+            writer.close()
+
+
+    async def handleRequest(self, connection, request):
+        command = request.get("cmd")
+
+        if command == "create":
+            numPlayers = int(request.get("players", 2))
+            if not 2 <= numPlayers <= 8:
+                return {"error": "a table has 2 to 8 players"}
+            backendName = request.get("backend", "analytic")
+            if not isinstance(backendName, str):
+                return {"error": "the backend must be a string"}
+            backend = card.Backend[backendName.upper()]
+            table = Table(self.nextTableId, numPlayers, backend)
+            self.tables[table.tableId] = table
+            self.nextTableId += 1
+            return {"table": table.tableId}
+
+        elif command == "join":
+            table = self.tables.get(int(request["table"]))
+            if table is None:
+                return {"error": "no such table"}
+            if connection.table is not None:
+                return {"error": "already seated at table " + str(connection.table.tableId)}
+            # like "state", wait for a running turn before reading the hand
+            async with table.lock:
+                if self.tables.get(table.tableId) is not table:
+                    return {"error": "no such table"}
+                seat = table.freeSeat()
+                if seat is None:
+                    return {"error": "the table is full"}
+                table.seats[seat] = connection
+                table.lastActive = time.perf_counter()
+                connection.table, connection.seat = table, seat
+                return {"seat": seat, "state": table.view(seat)}
+
+        elif command == "state":
+            if connection.table is None:
+                return {"error": "not seated"}
+            # wait for a running turn, its state is only consistent afterwards
+            async with connection.table.lock:
+                return {"state": connection.table.view(connection.seat)}
+
+        elif command == "play":
+            return await self.playTurn(connection, request["action"])
+
+        elif command == "tables":
+            return {"tables": [{"table": table.tableId, "players": len(table.seats),
+                                "freeSeats": table.seats.count(None), "turn": table.game.turnCount,
+                                "over": table.game.isOver()} for table in self.tables.values()]}
+
+        elif command == "metrics":
+            return self.metrics()
+
+        return {"error": "unknown command " + str(command)}
+
+
+    async def playTurn(self, connection, action):
+        table = connection.table
+        if table is None:
+            return {"error": "not seated"}
+        action = engine.GameEngine.DRAW if action == "draw" else int(action)
+
+        start = time.perf_counter()
+        async with table.lock:
+            game = table.game
+            if game.isOver():
+                return {"error": "the game is over"}
+            if connection.seat != game.playerIndex:
+                return {"error": "it is not your turn"}
+            if action not in game.legal_actions():
+                return {"error": "illegal action"}
+
+            # the measurements block, so the turn runs on the pool
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(self.executor, game.step, action)
+
+        seconds = time.perf_counter() - start
+        table.lastActive = time.perf_counter()
+        table.turnLatency.record(seconds)
+        self.turnLatency.record(seconds)
+
+        # every other seated client gets the new state right away
+        for seat, other in enumerate(table.seats):
+            if other is not None and other is not connection:
+                other.send({"event": "turn", "state": table.view(seat)})
+
+        return {
+            "measured" : None if result.measuredResult is None else
+                         [str(result.measuredResult[0]), str(result.measuredResult[1])],
+            "drawn" : None if result.drawnCard is None else cardView(result.drawnCard),
+            "over" : result.isOver,
+            "state" : table.view(connection.seat),
+        }
+
+
+    def metrics(self):
+        return {
+            "uptimeSeconds" : time.perf_counter() - self.startTime,
+            "tables" : len(self.tables),
+            "removedTables" : self.removedTables,
+            "activeTables" : sum(1 for table in self.tables.values() if not table.game.isOver()),
+            "turns" : self.turnLatency.summary(),
+            "requests" : self.requestLatency.summary(),
+            "perTable" : {table.tableId: table.turnLatency.summary() for table in self.tables.values()},
+        }
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Hosts QUNO tables over TCP (JSON lines).")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=None, help="threads for the quantum measurements")
+    args = parser.parse_args()
+
+    print("QUNO server listening on {}:{}".format(args.host, args.port))
+    asyncio.run(QunoServer(args.workers).serve(args.host, args.port))
@@ -0,0 +1,329 @@
+from collections import OrderedDict
+import threading
+import numpy as np
+import card, instrument, statevector
+
+class QuantumSession:
+    """ Runs every quantum measurement of one game
+
+    Instead of resolving the Aer backend and transpiling a fresh circuit
+    on every card play and deck draw, a game owns a single session.
+    The session holds one simulator instance for the whole game and
+    caches transpiled circuits, so a circuit that was already seen
+    (e.g. the Grover circuit of a Red 3 card) is sent straight to the
+    simulator.
+
+    qiskit is only imported once a circuit actually has to be simulated.
+
+    Attributes
+    ----------------
+    backend : card.Backend
+        Which simulator the measurements of this game run on.
+    shots : int
+        The number of shots for every circuit.
+    rng : numpy.random.Generator
+        Random number generator for the sampling done outside of Aer
+        (the ANALYTIC backend and the NumPy statevector simulator).
+    transpiledCircuits : OrderedDict
+        Maps a circuit key to its transpiled circuit, oldest first.
+        At most maxCachedCircuits circuits are kept.
+    distributions : OrderedDict
+        Maps a circuit key to the distribution of its measured (top) outcome,
+        as a tuple (bitstrings, probabilities), oldest first. At most
+        maxCachedDistributions distributions are kept.
+    distributionHits, distributionMisses : int
+        How many queued circuits were sampled from a cached distribution,
+        and how many had to be simulated.
+    cacheLock : threading.Lock
+        Held while either cache is read or changed. Forks share the caches
+        and the lock, and may run on other threads (see speculation.py).
+
+    Two measurements of the same circuit (e.g. two Red 3 / Blue 5 cards)
+    only differ in the sampled outcome. With cacheDistributions, the first
+    run of a circuit key stores the distribution of its outcome, computed
+    from the exact probabilities the caller knows (see storeDistribution()),
+    and every later measurement of that key is a weighted sample from it
+    instead of another run of the circuit.
+    """
+
+    def __init__(self, backend=None, shots=1024, seed=None, maxCachedCircuits=256,
+                 cacheDistributions=True, maxCachedDistributions=1024):
+        self.backend = backend if backend is not None else card.Backend.AER
+        self.shots = shots
+        self.rng = np.random.default_rng(seed)
+
+        self.simulator = None
+        self.transpiledCircuits = OrderedDict()
+        self.maxCachedCircuits = maxCachedCircuits
+
+        self.cacheDistributions = cacheDistributions
+        self.distributions = OrderedDict()
+        self.maxCachedDistributions = maxCachedDistributions
+        self.distributionHits = 0
+        self.distributionMisses = 0
+        self.cacheLock = threading.Lock()
+
+
+    def fork(self, seed=None, backend=None):
+        """ Returns a session for a forked game, see GameEngine.fork()
+
+        The caches are shared with this session. The fork gets its own
+        random number generator: a copy of this one, or a new one from
+        'seed'. 'backend' switches the fork to another backend.
+        """
+        forked = QuantumSession.__new__(QuantumSession)
+        forked.__dict__.update(self.__dict__)
+        forked.rng = copyGenerator(self.rng) if seed is None else np.random.default_rng(seed)
+        if backend is not None:
+            forked.backend = backend
+        if forked.backend != card.Backend.AER:
+            forked.simulator = None # the statevector simulator samples with the session's rng
+        forked.distributionHits = 0
+        forked.distributionMisses = 0
+        return forked
+
+
+    # Resolves the simulator the first time it is needed
+    def getSimulator(self):
+        if self.simulator is None:
+            if self.backend == card.Backend.AER:
+                from qiskit import Aer
+                self.simulator = Aer.get_backend('aer_simulator')
+            else:
+                self.simulator = statevector.StatevectorSimulator(self.rng)
+        return self.simulator
+
+
+    # Describes the structure of a circuit: every instruction with its qubits, clbits and parameters
+    @classmethod
+    def circuitKey(self, qc):
+        qubitIndex = {q: i for i, q in enumerate(qc.qubits)}
+        clbitIndex = {c: i for i, c in enumerate(qc.clbits)}
+        return (qc.num_qubits, qc.num_clbits) + tuple(
+            (instruction.name,
+             tuple(qubitIndex[q] for q in qargs),
+             tuple(clbitIndex[c] for c in cargs),
+             tuple(float(p) for p in instruction.params))
+            for instruction, qargs, cargs in qc.data)
+
+
+    def transpiled(self, qc, key):
+        """ Returns the transpiled version of 'qc' for the Aer backend
+
+        Circuits are cached by 'key', so callers that already know what
+        uniquely determines their circuit (e.g. the states of a card) can
+        skip building the structural key.
+        """
+        if key is None:
+            key = QuantumSession.circuitKey(qc)
+
+        with self.cacheLock:
+            if key in self.transpiledCircuits:
+                self.transpiledCircuits.move_to_end(key)
+                return self.transpiledCircuits[key]
+
+        from qiskit import transpile
+        transpiledQC = transpile(qc, self.getSimulator())
+        with self.cacheLock:
+            self.transpiledCircuits[key] = transpiledQC
+            if len(self.transpiledCircuits) > self.maxCachedCircuits:
+                self.transpiledCircuits.popitem(last=False)
+        return transpiledQC
+
+
+    def run(self, qc, key=None):
+        """ Measures 'qc' and returns a dictionary of bitstrings to hit counts
+
+        'key' must uniquely identify the structure of qc, see transpiled().
+        """
+        return self.runMany([qc], [key])[0]
+
+
+    def runMany(self, circuits, keys):
+        """ Measures every circuit in a single backend job
+
+        Returns a list with the counts dictionary of each circuit, in order.
+        """
+        if len(circuits) == 0:
+            return []
+
+        startTime = instrument.start()
+        simulator = self.getSimulator()
+        if self.backend == card.Backend.AER:
+            transpiledCircuits = [self.transpiled(qc, key) for qc, key in zip(circuits, keys)]
+            result = simulator.run(transpiledCircuits, shots=self.shots).result()
+            allCounts = [result.get_counts(i) for i in range(len(circuits))]
+        else:
+            allCounts = [simulator.run(qc, shots=self.shots) for qc in circuits]
+        instrument.stop(instrument.EXECUTE, startTime)
+        return allCounts
+
+
+    # Returns the cached distribution of the circuit 'key' (or None), and counts the hit/miss
+    def cachedDistribution(self, key):
+        if not self.cacheDistributions or key is None:
+            return None
+
+        with self.cacheLock:
+            if key in self.distributions:
+                self.distributions.move_to_end(key)
+                self.distributionHits += 1
+                return self.distributions[key]
+
+        self.distributionMisses += 1
+        return None
+
+
+    def storeDistribution(self, key, probabilities):
+        """ Stores the distribution of the top outcome of the circuit 'key'
+
+        'probabilities' maps the bitstrings of the circuit to their exact
+        probability in a single shot. Every measurement keeps the outcome
+        with the most hits over all shots, which is one of the most likely
+        outcomes, each as often as the others: e.g. either state of a
+        superposition card, or either color of the deck at phase pi/2.
+        The distribution is never estimated from the counts of a run, since
+        a single run can make two equally likely outcomes look one-sided.
+        """
+        if not self.cacheDistributions or key is None:
+            return
+
+        mostLikely = max(probabilities.values())
+        bitStrings = [bitString for bitString, probability in probabilities.items() if probability >= mostLikely - 1e-9]
+        with self.cacheLock:
+            self.distributions[key] = (bitStrings, np.full(len(bitStrings), 1 / len(bitStrings)))
+            if len(self.distributions) > self.maxCachedDistributions:
+                self.distributions.popitem(last=False)
+
+
+    # Samples the top outcome from a cached distribution, returns it as a counts dictionary
+    def sampleCounts(self, distribution):
+        bitStrings, probabilities = distribution
+        return {bitStrings[self.rng.choice(len(bitStrings), p=probabilities)]: self.shots}
+
+
+    def sampleTopOutcome(self, probabilities):
+        """ Samples a measurement result without simulating any circuit
+
+        Mirrors the circuit path: draw 'shots' samples from the exact
+        distribution 'probabilities' and return the index of the outcome
+        with the most hits.
+        """
+        counts = self.rng.multinomial(self.shots, probabilities)
+        return int(np.argmax(counts))
+
+
+    # Starts a new batch of measurements on this session
+    def batch(self):
+        return MeasurementBatch(self)
+
+
+
+# Returns an independent numpy Generator in the same state as 'rng'
+def copyGenerator(rng):
+    bitGenerator = type(rng.bit_generator)(0)
+    bitGenerator.state = rng.bit_generator.state
+    return np.random.Generator(bitGenerator)
+
+
+
+class PendingMeasurement:
+    """ The result of a measurement queued on a MeasurementBatch
+
+    The result becomes available once the batch has been run.
+    """
+
+    def __init__(self, decode):
+        self.decode = decode
+        self.isDone = False
+        self.value = None
+
+
+    # Called by MeasurementBatch.run() with the counts of the circuit (or None)
+    def resolve(self, counts):
+        self.value = self.decode(counts)
+        self.isDone = True
+
+
+    def result(self):
+        assert self.isDone, \
+              "ERROR in PendingMeasurement.result() - The batch of this measurement has not been run yet."
+        return self.value
+
+
+
+class MeasurementBatch:
+    """ Gathers many measurements into a single backend job
+
+    Callers queue their circuits with addCircuit() together with a 'decode'
+    function that turns the counts of the circuit into their result.
+    Measurements that need no circuit at all (e.g. on the ANALYTIC backend)
+    are queued with addSample(). run() sends every queued circuit to the
+    session in one job, so the job overhead is paid once per batch instead
+    of once per card.
+
+    Circuits whose key has a cached distribution in the session are not
+    sent to the backend; their counts are sampled from the distribution.
+    """
+
+    def __init__(self, quantumSession):
+        self.session = quantumSession
+        self.circuits = []
+        self.keys = []
+        self.probabilities = []
+        self.pendingCircuits = []
+        self.pendingSamples = []
+
+
+    def addCircuit(self, qc, key, decode, probabilities=None):
+        """ Queues the circuit 'qc', whose counts are passed to decode()
+
+        'qc' may also be a function that builds the circuit, so that the
+        circuit is only built when it is not in the distribution cache.
+        'probabilities' is a function returning the exact single-shot
+        probability of every bitstring of the circuit. It is only called
+        once the circuit has run, to cache its distribution (see
+        QuantumSession.storeDistribution()); without it, the circuit is
+        not cached and runs every time.
+        """
+        distribution = self.session.cachedDistribution(key) if probabilities is not None else None
+        if distribution is not None:
+            return self.addSample(lambda: decode(self.session.sampleCounts(distribution)))
+
+        pending = PendingMeasurement(decode)
+        self.circuits.append(qc() if callable(qc) else qc)
+        self.keys.append(key)
+        self.probabilities.append(probabilities)
+        self.pendingCircuits.append(pending)
+        return pending
+
+
+    # 'sample' takes no arguments and is called when the batch runs
+    def addSample(self, sample):
+        pending = PendingMeasurement(lambda counts: sample())
+        self.pendingSamples.append(pending)
+        return pending
+
+
+    def run(self):
+        """ Runs every queued measurement and resolves their PendingMeasurements
+
+        The batch is emptied afterwards, so it can be reused.
+        """
+        allCounts = self.session.runMany(self.circuits, self.keys)
+        for pending, key, probabilities, counts in zip(self.pendingCircuits, self.keys, self.probabilities, allCounts):
+            startTime = instrument.start()
+            if probabilities is not None:
+                self.session.storeDistribution(key, probabilities())
+            pending.resolve(counts)
+            instrument.stop(instrument.DECODE, startTime)
+        for pending in self.pendingSamples:
+            startTime = instrument.start()
+            pending.resolve(None)
+            instrument.stop(instrument.SAMPLE, startTime)
+
+        self.circuits = []
+        self.keys = []
+        self.probabilities = []
+        self.pendingCircuits = []
+        self.pendingSamples = []
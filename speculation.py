@@ -0,0 +1,112 @@
+""" Measures the possible moves of a turn while the player is still deciding
+
+A human player spends seconds reading their hand, while the measurement
+of the card they finally pick (or of the top of the deck) only starts
+once they have chosen. A Speculator measures every card of the current
+hand and the top of the deck on a background thread as soon as the turn
+begins, and hands the outcome of the chosen move to GameEngine.step().
+"""
+import concurrent.futures
+import numpy as np
+import engine
+
+
+class Speculator:
+    """ Speculatively measures the moves of the current player
+
+    The speculative measurements run on copies: a copy of every card and
+    a fork of the deck (see Deck.fork()), on a fork of the game's session
+    with its own random numbers. They never change the game, and every
+    outcome is used at most once, so a speculated outcome is as random as
+    a measurement made after the choice.
+
+    Outcomes are kept until they become invalid:
+        - a card's outcome, for as long as the card is in a hand
+          (cards in a hand never change, see Player), and
+        - the outcome of the top of the deck, until the deck changes it
+          (a draw or an Add Phase play, see Deck.topCardVersion).
+
+    Attributes
+    ----------------
+    cardOutcomes : dict
+        Maps each card to the Future of its measured (Color, Type).
+    deckOutcome : Future
+        The Future of the card drawn from the top of the deck, or None.
+    deckVersion : int
+        The Deck.topCardVersion deckOutcome was measured for.
+    hits, misses : int
+        How many moves used a speculated outcome, and how many did not.
+    """
+
+    def __init__(self, seed=None):
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.seeds = np.random.SeedSequence(seed)
+        self.cardOutcomes = {}
+        self.deckOutcome = None
+        self.deckVersion = None
+        self.hits = 0
+        self.misses = 0
+
+
+    def start(self, game):
+        """ Starts measuring the moves of the current player of 'game'
+
+        Call at the beginning of the turn. Returns right away.
+        """
+        # drop the outcomes of cards that are no longer in any hand
+        heldCards = set()
+        for currentPlayer in game.players:
+            heldCards.update(currentPlayer.cards)
+        for heldCard in list(self.cardOutcomes):
+            if heldCard not in heldCards:
+                self.cardOutcomes.pop(heldCard).cancel()
+
+        if self.deckOutcome is not None and self.deckVersion != game.deck.topCardVersion:
+            self.deckOutcome.cancel()
+            self.deckOutcome = None
+
+        # the speculative session shares the caches of the game's session
+        speculativeSession = game.session.fork(self.seeds.spawn(1)[0])
+
+        if self.deckOutcome is None:
+            speculativeDeck = game.deck.fork(speculativeSession, self.seeds.spawn(1)[0])
+            self.deckOutcome = self.executor.submit(speculativeDeck.getTopCard)
+            self.deckVersion = game.deck.topCardVersion
+
+        for heldCard in game.currentPlayer().cards:
+            if not heldCard.isEntangled and heldCard not in self.cardOutcomes:
+                self.cardOutcomes[heldCard] = self.executor.submit(heldCard.copy().measure, speculativeSession)
+
+
+    def take(self, game, action):
+        """ Returns the speculated outcome of 'action' for GameEngine.step(), or None
+
+        The outcome is removed, so it is never used twice. Measurements
+        that have not started yet are cancelled when their move is chosen,
+        since step() can measure the move just as fast itself.
+        """
+        if action == engine.GameEngine.DRAW:
+            future = self.deckOutcome if self.deckVersion == game.deck.topCardVersion else None
+            self.deckOutcome = None
+        else:
+            heldCard = game.currentPlayer().cards[action]
+            if heldCard.isEntangled:
+                return None # revealing an entangled card measures nothing
+            future = self.cardOutcomes.pop(heldCard, None)
+
+        if future is None or not (future.running() or future.done()) or future.cancelled():
+            if future is not None:
+                future.cancel()
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return future.result()
+
+
+    def shutdown(self):
+        for future in self.cardOutcomes.values():
+            future.cancel()
+        if self.deckOutcome is not None:
+            self.deckOutcome.cancel()
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,165 @@
+import numpy as np
+
+class StatevectorSimulator:
+    """ A small NumPy statevector simulator for the circuits of this game
+
+    Every circuit that QUNO builds has at most 7 qubits (a 128-amplitude
+    statevector), so the full Qiskit transpile -> Aer job pipeline is
+    far more machinery than needed. This simulator walks the instructions
+    of a QuantumCircuit and applies each gate directly to the statevector
+    as a vectorized array operation.
+
+    The statevector is stored as an n-dimensional array of shape (2,)*n.
+    Following Qiskit's little-endian ordering, qubit q lives on axis n-1-q,
+    so flattening the array gives the usual basis state index.
+
+    Supported instructions are the ones emitted by card.py and deck.py:
+    h, x, id, u1/p, cu1/cp, ry, cx and measure (plus z, s, t, barrier).
+    Any other instruction is expanded through its definition.
+    All measurements are treated as if they happen at the end of the circuit.
+
+    Attributes
+    ----------------
+    rng : numpy.random.Generator
+        The random number generator used to sample the measurement shots.
+    """
+
+    SQRT_HALF = 1 / np.sqrt(2)
+
+    # Single-qubit gates without parameters
+    FIXED_GATES = {
+        "h"  : np.array([[SQRT_HALF, SQRT_HALF], [SQRT_HALF, -SQRT_HALF]], dtype=complex),
+        "x"  : np.array([[0, 1], [1, 0]], dtype=complex),
+        "id" : np.eye(2, dtype=complex),
+        "i"  : np.eye(2, dtype=complex),
+    }
+
+    # Gates that only add a phase to the |1> state
+    FIXED_PHASES = {
+        "z" : np.pi,
+        "s" : np.pi / 2,
+        "t" : np.pi / 4,
+    }
+
+
+    def __init__(self, seed=None):
+        self.rng = np.random.default_rng(seed)
+
+
+    # Applies the 2x2 matrix 'gate' to the given axis of 'state'
+    @classmethod
+    def applyMatrix(self, state, gate, axis):
+        state = np.tensordot(gate, state, axes=([1], [axis]))
+        return np.moveaxis(state, 0, axis)
+
+
+    def applyInstructions(self, state, circuit, qubitMap, measured):
+        """ Applies every instruction of 'circuit' to 'state'
+
+        qubitMap translates the circuit's Qubit objects to axes of state,
+        and measured collects (axis, clbit index) pairs from measure
+        instructions. Returns the updated statevector.
+        """
+        clbitMap = {clbit: i for i, clbit in enumerate(circuit.clbits)}
+
+        for instruction, qargs, cargs in circuit.data:
+            name = instruction.name
+            axes = [qubitMap[q] for q in qargs]
+
+            if measured and name != "barrier":
+                measuredAxes = [m[0] for m in measured]
+                assert all(axis not in measuredAxes for axis in axes), \
+                      "ERROR in StatevectorSimulator.applyInstructions() - Gate '" + name \
+                      + "' acts on a qubit that was already measured."
+
+            if name == "barrier":
+                continue
+            elif name == "measure":
+                measured.append((axes[0], clbitMap[cargs[0]]))
+            elif name in StatevectorSimulator.FIXED_GATES:
+                state = StatevectorSimulator.applyMatrix(state, StatevectorSimulator.FIXED_GATES[name], axes[0])
+            elif name in StatevectorSimulator.FIXED_PHASES or name in ("u1", "p"):
+                if name in StatevectorSimulator.FIXED_PHASES:
+                    angle = StatevectorSimulator.FIXED_PHASES[name]
+                else:
+                    angle = float(instruction.params[0])
+                index = [slice(None)] * state.ndim
+                index[axes[0]] = 1
+                state[tuple(index)] *= np.exp(1j * angle)
+            elif name in ("cu1", "cp"):
+                index = [slice(None)] * state.ndim
+                index[axes[0]] = 1
+                index[axes[1]] = 1
+                state[tuple(index)] *= np.exp(1j * float(instruction.params[0]))
+            elif name == "ry":
+                halfAngle = float(instruction.params[0]) / 2
+                gate = np.array([[np.cos(halfAngle), -np.sin(halfAngle)],
+                                 [np.sin(halfAngle), np.cos(halfAngle)]], dtype=complex)
+                state = StatevectorSimulator.applyMatrix(state, gate, axes[0])
+            elif name == "cx":
+                control, target = axes
+                index = [slice(None)] * state.ndim
+                index[control] = 1
+                # the control axis disappears from the view, shifting the target axis
+                targetInView = target - 1 if control < target else target
+                state[tuple(index)] = np.flip(state[tuple(index)], axis=targetInView)
+            elif instruction.definition is not None:
+                definition = instruction.definition
+                innerMap = {q: axes[i] for i, q in enumerate(definition.qubits)}
+                state = self.applyInstructions(state, definition, innerMap, measured)
+            else:
+                assert False, \
+                      "ERROR in StatevectorSimulator.applyInstructions() - Unsupported gate '" + name + "'."
+
+        return state
+
+
+    def simulate(self, circuit):
+        """ Runs 'circuit' from the all-zero state
+
+        Returns the tuple (statevector, measured), where statevector is a flat
+        array of 2^n amplitudes and measured is a list of (qubit, clbit) pairs.
+        """
+        n = circuit.num_qubits
+        state = np.zeros((2,) * n, dtype=complex)
+        state[(0,) * n] = 1
+
+        qubitMap = {q: n - 1 - i for i, q in enumerate(circuit.qubits)}
+        measured = []
+        state = self.applyInstructions(state, circuit, qubitMap, measured)
+
+        # convert the axes back into qubit indices
+        measured = [(n - 1 - axis, clbit) for axis, clbit in measured]
+        return (state.reshape(-1), measured)
+
+
+    def probabilities(self, circuit):
+        """ Returns the exact distribution over the classical register
+
+        The result is an array indexed by the integer value of the classical
+        register (clbit 0 is the least significant bit).
+        """
+        statevector, measured = self.simulate(circuit)
+        basisProbabilities = np.abs(statevector)**2
+
+        basisStates = np.arange(len(statevector))
+        outcomes = np.zeros(len(statevector), dtype=int)
+        for qubit, clbit in measured:
+            outcomes |= ((basisStates >> qubit) & 1) << clbit
+
+        return np.bincount(outcomes, weights=basisProbabilities, minlength=2**circuit.num_clbits)
+
+
+    def run(self, circuit, shots=1024):
+        """ Samples 'shots' measurements of the circuit
+
+        Returns a dictionary of bitstrings to hit counts, in the same format
+        as Qiskit's Result.get_counts().
+        """
+        probabilities = self.probabilities(circuit)
+        probabilities = probabilities / probabilities.sum()
+        counts = self.rng.multinomial(shots, probabilities)
+
+        width = circuit.num_clbits
+        return {np.binary_repr(outcome, width=width): int(hits)
+                for outcome, hits in enumerate(counts) if hits > 0}